@@ -12,6 +12,7 @@ This module contains:
 import sys
 
 from world import World
+from blockreader import BlockReader
 from ai import Bot
 from checklocal import RUNS_LOCALLY, BOT_DO_TURN_F, WORLD_UPDATE_F
 
@@ -80,24 +81,18 @@ def run():
         # the overlay works like the logging: the overlay.overlay object is
         # the Overlay() intantiation
         overlay.target_bot(bot)
-    data = []
+    reader = BlockReader()
     while(True):
         try:
-            current_line = sys.stdin.readline().strip().lower()
-            if not current_line:
-                continue  #skip empty lines
-            if current_line == 'ready':
-                world.setup(data)
+            terminator, block = reader.read_block()
+            if terminator == 'ready':
+                world.setup(block)
                 bot.do_setup()
                 world.finish_turn()
-                data = []
-            elif current_line == 'go':
-                world.update(data)
+            else:
+                world.update(block)
                 bot.do_turn()
                 world.finish_turn()
-                data = []
-            else:
-                data.append(current_line)
         except EOFError as e:  # game is over or game engine has crashed
             print(e)
             break
@@ -9,12 +9,15 @@ to the game API.
 '''
 
 from random import shuffle, choice
+from time import time
 
-from numpy import any as np_any
-from numpy import array
+from numpy import log1p, in1d, inf, arange, flatnonzero, column_stack
 
 from world import WATER, OWN_HILLS, H_EXPLORE, H_HARVEST, H_FIGHT, EXPLORER, \
-                  HARVESTER, ATTACKER, OWN_ANTS
+                  HARVESTER, ATTACKER, OWN_ANTS, MOVES, MOVE_INDEX, \
+                  MOVE_LETTERS
+from combat import get_battle_groups, search_battle, COMBAT_TIME_SHARE
+from assignment import assign, ASSIGNMENT_TIME_SHARE
 
 from checklocal import RUNS_LOCALLY
 if RUNS_LOCALLY:
@@ -58,7 +61,8 @@ class Bot(object):
         '''
         # Init turn variables
         self.ants_to_process = set(self.world.own_ants.keys())
-        self.destinations = set(())  # tiles that are targeted by a movement
+        # tiles (flat indices) that are targeted by a movement
+        self.destinations = set(())
 
         # Turn phases
         self.attack()
@@ -69,58 +73,84 @@ class Bot(object):
 
     def attack(self):
         '''
-        Manage attacking ants.
+        Manage attacking ants. Enemies and own ants which are at attackradius
+        + 2 are split in independent battle groups, and the moves of the own
+        ants of each group are chosen by an anytime search, which gets a
+        slice of the combat time left proportional to the size of the group
+        (searches ending early leave their time to the next groups, then to
+        the rest of the turn).
         '''
         world = self.world
-        # Isolate enemies and own ants which are at attackradius + 2.
-        enemy_engageable = {}
-        own_engageable = {}
-        f = self.world.get_engageable
-        for enemy in world.enemy_ants:
-            tmp = f(enemy)
-            if np_any(tmp):
-                tmp = set([tuple(loc) for loc in tmp])
-                enemy_engageable[enemy] = tmp
-                for own in tmp:
-                    try:
-                        own_engageable[own].add(enemy)
-                    except KeyError:
-                        own_engageable[own] = set(enemy)
+        groups = get_battle_groups(world)
+        if not groups:
+            return
         if RUNS_LOCALLY:
-            log.debug('# OWN ENGAGEABLE : %s' % own_engageable)
-            log.debug('# ENEMY ENGAGEABLE : %s' % enemy_engageable)
-
-        # BASIC, INTIAL STRATEGY (PROBABLY ONLY GOOD FOR ISOLATED ENEMIES)
-        # Notably, it does not consider clusters of enemy ants, pretending
-        # enemy ants are always isolated.
-
-        attack_mask = world.attack_mask
+            log.debug('# BATTLE GROUPS : %s' % groups)
+            self._show_dangers(groups)
+        # combat must be over when the time remaining drops to this
+        end_at = world.time_remaining() * (1 - COMBAT_TIME_SHARE)
+        left = float(sum([len(group) for group in groups]))
+        for group in groups:
+            remaining = world.time_remaining()
+            stop_at = remaining - (remaining - end_at) * len(group) / left
+            left -= len(group)
+            moves, value = search_battle(world, group, stop_at,
+                                         self.destinations)
+            if RUNS_LOCALLY:
+                # a list, as numpy would wrap a long array over several lines
+                log.debug('# BATTLE %s : %s (value %s)' % (group,
+                                                           moves.tolist(),
+                                                           value))
+            if value is None:  # no time to search: ants do their usual job
+                continue
+            dests = world.neighbours[world.get_flat_indices(group.own),
+                                     moves]
+            moving = flatnonzero(moves)
+            world.issue_orders(group.own[moving],
+                               MOVE_LETTERS[moves[moving]].tostring())
+            self.destinations.update(dests.tolist())
+            self.ants_to_process.difference_update(
+                [tuple(ant) for ant in group.own.tolist()])
+
+    def _show_dangers(self, groups):
+        '''
+        Send to the overlay, for each enemy, the moves of the engageable own
+        ants that would end up within its attack radius, and the enemy moves
+        they would be in range of.
+        '''
+        world = self.world
         get_legal_moves = world.get_legal_moves
-        for enemy, engageable in enemy_engageable.items():
+        get_combat_outcomes = world.get_combat_outcomes
+        engagements = []  # (enemy, own ants engageable by it)
+        for group in groups:
+            owns = [tuple(own) for own in group.own.tolist()]
+            for index, enemy in enumerate(group.enemies.tolist()):
+                engageable = group.edges[group.edges[:, 1] == index, 0]
+                engagements.append((tuple(enemy),
+                                    [owns[own] for own in engageable]))
+        for enemy, engageable in engagements:
             own_moves = {}
-            enemy_moves = get_legal_moves(enemy)
+            enemy_moves = [(edest, edir, MOVE_INDEX[edir]) for edest, edir in
+                           get_legal_moves(enemy)]
             for own in engageable:
                 own_moves[own] = {}
                 # Here's the key-passage: find out how each move would score
                 # relative to the opponent's one.
+                outcomes = get_combat_outcomes(own, enemy)
+                if outcomes is None:
+                    continue
                 for odest, odir in get_legal_moves(own):
-                    for edest, edir in enemy_moves:
-                        if odest in world.get_in_attackradius(edest):
+                    odest = tuple(odest)
+                    in_range = outcomes[MOVE_INDEX[odir]]
+                    for edest, edir, emove in enemy_moves:
+                        if in_range[emove]:
                             try:
                                 own_moves[own][odest, odir].append((edest,
                                                                     edir))
                             except KeyError:
                                 own_moves[own][odest, odir] = [(edest, edir)]
-            if RUNS_LOCALLY:
-                log.debug('# OWN MOVES FOR ENEMY %s : %s' % (enemy, own_moves))
-                overlay.show_dangers(own_moves)
-        #if RUNS_LOCALLY:
-            #overlay.show_battlegroups(own_engageable, enemy_engageable)
-
-
-        # - Wait for 2 own engageable by 1 enemy, else goback.
-        # - Try to find which moves of each own ants would result in the same
-        #   (enemy, movement) tuples.
+            log.debug('# OWN MOVES FOR ENEMY %s : %s' % (enemy, own_moves))
+            overlay.show_dangers(own_moves)
 
     def harvest(self):
         '''
@@ -129,23 +159,26 @@ class Bot(object):
         world = self.world
         destinations = self.destinations
         own_ants = self.ants_to_process
-        for loc in world.food:
-            ranking = []  # will contain tuples: scent, dest, direction, ant
-            ants = world.get_stuff_in_sight(loc, OWN_ANTS)
-            for ant in ants:
-                ant = tuple(ant)
-                if ant not in own_ants:  #already busy with something
-                    continue
-                options = world.get_scent_strengths(ant, H_HARVEST)
-                for option in options:
-                    option.append(ant)
-                    ranking.append(option)
-            ranking.sort(reverse=True)
-            for scent, dest, direction, ant in ranking:
-                dest = tuple(dest)
-                if not dest in destinations \
-                            and world.is_tile_passable(dest):
-                    world.issue_order((ant, direction))
+        foods = world.food.keys()
+        queries, ants = world.get_stuff_in_sight_batch(foods, OWN_ANTS)
+        in_sight = [[] for food in foods]
+        for query, ant in zip(queries.tolist(), ants.tolist()):
+            in_sight[query].append(tuple(ant))
+        passable = world.get_passable()
+        for ants in in_sight:
+            ants = [ant for ant in ants if ant in own_ants]  # not busy yet
+            if not ants:
+                continue
+            scents, dests = world.get_scent_strengths_all(ants, H_HARVEST)
+            # all the options of all the ants, strongest scent first
+            ranking = (-scents).ravel().argsort(kind='mergesort')
+            dests = dests.tolist()
+            for ant_index, move in [divmod(option, 4) for option in
+                                    ranking.tolist()]:
+                dest = dests[ant_index][move]
+                if not dest in destinations and passable[dest]:
+                    ant = ants[ant_index]
+                    world.issue_order((ant, MOVES[move + 1]))
                     destinations.add(dest)
                     own_ants.remove(ant)
                     break
@@ -153,21 +186,39 @@ class Bot(object):
     def explore(self):
         '''
         Move all the ants that haven't been assigned to any specific and
-        alternative task towards the strongest scent.
+        alternative task towards the strongest scent. Ants compete for the
+        tiles in an auction, so that crowds don't waste moves in collisions.
         '''
         world = self.world
         destinations = self.destinations
-        own_ants = self.ants_to_process
-        for ant in own_ants:
-            scents_by_strength = world.get_scent_strengths(ant, H_EXPLORE)
-            for scent, dest, direction in scents_by_strength:
-                dest = tuple(dest)
-                if not dest in destinations and world.is_tile_passable(dest):
-                    world.issue_order((ant, direction))
-                    destinations.add(dest)
-                    break
-            else:  #executes only if a break is never called
-                destinations.add(ant)
+        ants = list(self.ants_to_process)
+        if not ants:
+            return
+        # moves and destinations of each ant, strongest scent first
+        rankings, dests = world.get_scent_rankings(ants, H_EXPLORE)
+        scents = world.map.planes[H_EXPLORE].ravel()[dests]
+        # scents span several orders of magnitude: scores are relative to the
+        # best option of each ant, on a log scale, so that ants close to a
+        # strong emitter don't outbid all the others
+        scores = log1p(scents) - log1p(scents[:, :1])
+        # tiles of exploring ants are free, as they are going to be vacated
+        # (unless their ant stays, but then the auction assigns them to it)
+        free = world.get_passable()[dests] | \
+               in1d(dests, world.get_flat_indices(ants)).reshape(dests.shape)
+        free &= ~in1d(dests, list(destinations)).reshape(dests.shape)
+        free |= rankings == 0  # staying is always possible
+        scores[~free] = -inf
+        time_limit = time() + \
+            world.time_remaining() * ASSIGNMENT_TIME_SHARE / 1000.0
+        stays = (rankings == 0).argmax(axis=1)
+        columns = assign(dests, scores, time_limit=time_limit, stays=stays)
+        index = arange(len(ants))
+        moves = rankings[index, columns]
+        destinations.update(dests[index, columns].tolist())
+        # the locations of the moving ants are the destinations of staying
+        moving = flatnonzero(moves)
+        locs = column_stack(divmod(dests[moving, stays[moving]], world.rows))
+        world.issue_orders(locs, MOVE_LETTERS[moves[moving]].tostring())
 
     def _get_fighters(self):
         '''
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+
+'''
+Contest entry for the Fall 2011 challenge on http://aichallenge.org
+
+This file contains the solver assigning the ants to the tiles they move to.
+Each ant has a few candidate tiles with a score, and no two ants may end up
+on the same tile: the assignment maximising the total score is found with a
+Jacobi auction (all the unassigned ants bid at once, at each round), in which
+tiles are "sold" to the ants valuing them the most.
+'''
+
+from collections import deque
+from time import time
+
+from numpy import arange, zeros, ones, unique, lexsort, isinf, where, \
+                  flatnonzero, concatenate, inf
+
+__author__ = "Mac Ryan"
+__copyright__ = "Copyright 2011, Mac Ryan"
+__license__ = "GPL v3"
+#__version__ = "<dev>"
+#__date__ = "<unknown>"
+__maintainer__ = "Mac Ryan"
+__email__ = "quasipedia@gmail.com"
+__status__ = "Development"
+
+
+# Minimum bid increment of the auction. The total score of the assignment
+# found is within N x EPSILON of the optimal one (N being the number of ants).
+AUCTION_EPSILON = 1e-2
+
+# Fraction of the time left that the explore phase gives to the auction.
+ASSIGNMENT_TIME_SHARE = 0.5
+
+
+def assign(candidates, scores, epsilon=AUCTION_EPSILON, time_limit=None,
+           stays=None):
+    '''
+    Assign each of N ants to one of its candidate tiles, so that no tile is
+    assigned twice and the total score is maximised. `candidates` is a N x K
+    array of tile ids (e.g. flat indices), `scores` the matching N x K array
+    of scores (-inf for the candidates an ant can't take). Among equal
+    scores, the candidate in the lowest column is preferred.
+    When `time_limit` (a value of time.time()) is reached, the auction stops
+    and the ants still unassigned take the best tile left, greedily. If
+    `stays` gives, for each ant, the column of a tile that only that ant can
+    fall back on (the one it stands on), an ant left without a free tile
+    takes back its own, and the ant it displaces goes on with the greedy
+    pass.
+    Return the column of the candidate assigned to each ant, -1 for the ants
+    left without a tile (only possible when there are not enough tiles for
+    all the ants and no `stays` are given).
+    '''
+    n_ants, n_columns = candidates.shape
+    tiles, objects = unique(candidates, return_inverse=True)
+    objects = objects.reshape(candidates.shape)
+    prices = zeros(len(tiles))
+    owners = -ones(len(tiles), dtype=int)
+    assigned = -ones(n_ants, dtype=int)  # column won by each ant
+    bidders = flatnonzero(~isinf(scores).all(axis=1))
+    rows = arange(n_ants)
+    # in a feasible problem a price is raised at most once for each ant in
+    # a chain of outbid ants, by at most the spread of the scores plus
+    # epsilon each time: an ant needing a higher price gives up its tile
+    finite = scores[~isinf(scores)]
+    if len(finite):
+        spread = finite.max() - finite.min()
+        floor = finite.min() - (n_ants + 1) * (spread + epsilon)
+    while len(bidders):
+        if time_limit is not None and time() > time_limit:
+            break
+        values = scores[bidders] - prices[objects[bidders]]
+        best = values.argmax(axis=1)
+        first = values[rows[:len(bidders)], best]
+        hopeless = first < floor
+        if hopeless.any():
+            bidders, best, first, values = bidders[~hopeless], \
+                best[~hopeless], first[~hopeless], values[~hopeless]
+            if not len(bidders):
+                break
+        values[rows[:len(bidders)], best] = -inf
+        second = values.max(axis=1)
+        second = where(isinf(second), first, second)  # a single option
+        targets = objects[bidders, best]
+        bids = prices[targets] + first - second + epsilon
+        # the highest bid on each tile wins (the first bidder among equals)
+        order = lexsort((-bids, targets))
+        won = order[concatenate(([True], targets[order][1:] !=
+                                 targets[order][:-1]))]
+        targets = targets[won]
+        outbid = owners[targets]
+        outbid = outbid[outbid >= 0]
+        assigned[outbid] = -1
+        owners[targets] = bidders[won]
+        assigned[bidders[won]] = best[won]
+        prices[targets] = bids[won]
+        lost = ones(len(bidders), dtype=bool)
+        lost[won] = False
+        bidders = concatenate((bidders[lost], outbid))
+    unassigned = flatnonzero(assigned < 0)
+    if len(unassigned):
+        _assign_greedily(unassigned, objects, scores, owners, assigned,
+                         stays)
+    return assigned
+
+
+def _assign_greedily(ants, objects, scores, owners, assigned, stays=None):
+    '''
+    Give the `ants` still unassigned their best free candidate, in order of
+    best score, updating `owners` and `assigned` in place. Ants without a
+    free candidate take back their tile in `stays` (if any), and its owner
+    is queued again: as an ant back on its own tile is never displaced, the
+    pass ends after at most N displacements.
+    '''
+    queue = deque(ants[(-scores[ants].max(axis=1)).argsort(kind='mergesort')
+                       ].tolist())
+    while queue:
+        ant = queue.popleft()
+        for column in (-scores[ant]).argsort(kind='mergesort').tolist():
+            if isinf(scores[ant, column]):
+                break
+            if owners[objects[ant, column]] < 0:
+                owners[objects[ant, column]] = ant
+                assigned[ant] = column
+                break
+        if assigned[ant] >= 0 or stays is None:
+            continue
+        tile = objects[ant, stays[ant]]
+        displaced = owners[tile]
+        owners[tile] = ant
+        assigned[ant] = stays[ant]
+        if displaced >= 0:
+            assigned[displaced] = -1
+            queue.append(displaced)
@@ -0,0 +1,650 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+
+'''
+Contest entry for the Fall 2011 challenge on http://aichallenge.org
+
+This file contains micro-benchmarks for the hot spots of the bot. It is not
+part of the uploaded package. It is a devel's tool.
+
+Each benchmark compares the current implementation with the one it replaced
+(kept here as a reference) on a synthetic, worst-case sized map.
+
+Usage: ``python bench.py [RECORDED_INPUT]``, where the optional argument is a
+file with the input sent by the game engine to a bot (used by the parser
+benchmark instead of the synthetic turn).
+'''
+
+import os
+import sys
+from time import time
+from random import Random
+
+from numpy import zeros, roll, where, nonzero, isnan, array, arange, \
+                  log1p, inf, lexsort, ones
+from numpy.random import RandomState
+
+from utils import dilate_count
+from world import World, JACOBI, SPARSE, BFS, SCENTS, SCENT_LAYERS, WATER, \
+                  FOOD, OWN_ANTS, ENEMY_ANTS, EXPLORER, JUST_SEEN, \
+                  UNSEEN_COUNTER, UNSEEN_LAND_STEP, MOVE_OFFSETS, H_EXPLORE, \
+                  H_HARVEST, MOVES
+from combat import apply_moves, resolve_battles
+from assignment import assign
+from ai import Bot
+
+__author__ = "Mac Ryan"
+__copyright__ = "Copyright 2011, Mac Ryan"
+__license__ = "GPL v3"
+#__version__ = "<dev>"
+#__date__ = "<unknown>"
+__maintainer__ = "Mac Ryan"
+__email__ = "quasipedia@gmail.com"
+__status__ = "Development"
+
+
+SETUP = '''turn 0
+           loadtime 3000
+           turntime 1000
+           rows %d
+           cols %d
+           turns 1000
+           viewradius2 77
+           attackradius2 5
+           spawnradius2 1
+           player_seed 42'''
+
+
+def get_turn_data(cols, rows, ants=500, seed=42):
+    '''
+    Return the lines of a synthetic turn: ~10% water, some food, `ants` own
+    ants and as many enemies.
+    '''
+    rnd = Random(seed)
+    lines = ['turn 1']
+    for i in range(cols * rows // 10):
+        lines.append('w %d %d' % (rnd.randrange(rows), rnd.randrange(cols)))
+    for i in range(ants // 5):
+        lines.append('f %d %d' % (rnd.randrange(rows), rnd.randrange(cols)))
+    for owner in (0, 1):
+        for i in range(ants):
+            lines.append('a %d %d %d' %
+                         (rnd.randrange(rows), rnd.randrange(cols), owner))
+    return lines
+
+
+def get_world(cols=200, rows=200, ants=500):
+    '''
+    Return a world after setup and one turn update.
+    '''
+    world = World()
+    world.setup([line.strip() for line in (SETUP % (rows, cols)).split('\n')])
+    world._update(get_turn_data(cols, rows, ants))
+    return world
+
+
+def read_turns(path):
+    '''
+    Return the setup lines and the list of turn blocks (lists of lines) of a
+    recorded engine input.
+    '''
+    setup, turns, data = [], [], []
+    for line in open(path):
+        line = line.strip().lower()
+        if not line:
+            continue
+        if line == 'ready':
+            setup, data = data, []
+        elif line == 'go':
+            turns.append(data)
+            data = []
+        else:
+            data.append(line)
+    return setup, turns
+
+
+def legacy_parse_input_lines(world, data):
+    '''
+    The parser as it was before the batch one: one `split` and one map write
+    per line.
+    '''
+    for line in data:
+        tokens = line.split()
+        if len(tokens) >= 3:
+            row = int(tokens[1])
+            col = int(tokens[2])
+            if tokens[0] == 'w':
+                world.map[col, row, WATER] = True
+            elif tokens[0] == 'f':
+                world.food[(col, row)] = 1
+            else:
+                owner = int(tokens[3])
+                if tokens[0] == 'a':
+                    if not owner:
+                        world.map[col, row, OWN_ANTS] = 1
+                        world.own_ants[(col, row)] = EXPLORER
+                    else:
+                        world.map[col, row, ENEMY_ANTS] = owner
+                        world.enemy_ants[(col, row)] = owner
+                elif tokens[0] == 'd':
+                    if not owner:
+                        world.own_dead[(col, row)] = 1
+                    else:
+                        world.enemy_dead[(col, row)] = [1, owner]
+                elif tokens[0] == 'h':
+                    if not owner:
+                        world.own_hills[(col, row)] = JUST_SEEN
+                    else:
+                        world.enemy_hills[(col, row)] = [JUST_SEEN, owner]
+        elif tokens[0] == 'turn':
+            world.turn = int(tokens[1])
+            world.turns_left = world.turns - world.turn
+
+
+def legacy_update_view_counter(world):
+    '''
+    The view counter update as it was before the dilation: one fancy-index
+    assignment of the view mask per own ant.
+    '''
+    mask = world.view_mask
+    counter = world.map[..., UNSEEN_COUNTER]
+    counter += UNSEEN_LAND_STEP
+    for loc in world.own_ants:
+        counter[tuple([(axis + loc[i]) % world.world_size[i]
+                       for i, axis in enumerate(mask)])] = 0
+
+
+def legacy_scent_mask(world):
+    '''
+    The scent mask as it was built before the SCENTS matrices: a nonzero scan
+    per layer, then two passes to turn 0 into -1 (transparent) and NaN into 0
+    (opaque). Return a COLS x ROWS x HORMONES array.
+    '''
+    scent_mask = zeros((world.cols, world.rows, 3), dtype=float)
+    for layer in SCENT_LAYERS:
+        plane = world.map[..., layer]
+        positions = nonzero(plane)
+        scent_mask[positions] += \
+            plane[positions].reshape(len(positions[0]), 1) * SCENTS[layer]
+    scent_mask[scent_mask == 0] = -1
+    scent_mask[isnan(scent_mask)] = 0
+    return scent_mask
+
+
+def legacy_diffuse(world, steps):
+    '''
+    The diffusion loop as it was before the `Diffuser` engine: 4 rolls and a
+    `where` per pass. Return the diffused COLS x ROWS x HORMONES field.
+    '''
+    scent_mask = legacy_scent_mask(world)
+    idx = scent_mask >= 0
+    single_layer = zeros((world.cols, world.rows, 3), dtype=float)
+    single_layer[idx] = scent_mask[idx]
+    layers = [single_layer, single_layer.copy()]
+    toggler = False
+    for counter in range(steps):
+        toggler = not toggler
+        source = layers[toggler]
+        dest = layers[not toggler]
+        dest *= 0
+        for amount, axis in ((1, 0), (1, 1), (-1, 0), (-1, 1)):
+            dest += roll(source, amount, axis=axis)
+        dest *= 0.25
+        dest[idx] += scent_mask[idx]
+        condition = where(scent_mask == 0)
+        dest[condition] = 0
+    return dest
+
+
+def bench_parser(path=None, repeat=5):
+    '''
+    Milliseconds to parse all the turns of a recorded game (or one synthetic
+    turn, if no recording is given): line by line vs batch parser.
+    '''
+    if path:
+        setup, turns = read_turns(path)
+        world = World()
+        world.setup(setup)
+        source = path
+    else:
+        world = get_world()
+        turns = [get_turn_data(world.cols, world.rows)]
+        source = 'synthetic %dx%d' % (world.cols, world.rows)
+    timings = []
+    for parse in (legacy_parse_input_lines, World._parse_input_lines):
+        start = time()
+        for i in range(repeat):
+            for data in turns:
+                world.own_ants = {}
+                world.enemy_ants = {}
+                parse(world, data)
+        timings.append((time() - start) * 1000 / repeat)
+    print('PARSER (%s, %d turns)' % (source, len(turns)))
+    print('  per line    : %.2f ms' % timings[0])
+    print('  batch       : %.2f ms' % timings[1])
+
+
+def bench_orders(world, repeat=20):
+    '''
+    Milliseconds to emit one order per own ant: a write per order vs a single
+    buffered write at the end of the turn (orders issued one by one, or all
+    at once with `issue_orders`).
+    '''
+    orders = [(ant, 'nesw'[i % 4]) for i, ant in enumerate(world.own_ants)]
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time()
+        for i in range(repeat):
+            for (col, row), direction in orders:
+                sys.stdout.write('o %s %s %s\n' % (row, col, direction))
+            sys.stdout.write('go\n')
+            sys.stdout.flush()
+        legacy = (time() - start) * 1000 / repeat
+        start = time()
+        for i in range(repeat):
+            for order in orders:
+                world.issue_order(order)
+            world.finish_turn()
+        current = (time() - start) * 1000 / repeat
+        # as the bot holds them: an array of locations, a string of letters
+        locs = array([ant for ant, direction in orders])
+        directions = ''.join([direction for ant, direction in orders])
+        start = time()
+        for i in range(repeat):
+            world.issue_orders(locs, directions)
+            world.finish_turn()
+        batch = (time() - start) * 1000 / repeat
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print('ORDERS (%d ants)' % len(orders))
+    print('  per order   : %.2f ms' % legacy)
+    print('  buffered    : %.2f ms' % current)
+    print('  batch       : %.2f ms' % batch)
+
+
+def bench_view_counter(world, repeat=20):
+    '''
+    Milliseconds to update the view counter: one mask per ant vs dilation.
+    '''
+    timings = []
+    for update in (legacy_update_view_counter, World._update_view_counter):
+        start = time()
+        for i in range(repeat):
+            update(world)
+        timings.append((time() - start) * 1000 / repeat)
+    print('VIEW COUNTER (%d ants)' % len(world.own_ants))
+    print('  per ant     : %.2f ms' % timings[0])
+    print('  dilation    : %.2f ms' % timings[1])
+
+
+def bench_view_count(world, repeat=20):
+    '''
+    Milliseconds to update the number of ants seeing each tile after some of
+    the ants moved one tile: full dilation vs crescents of the moved ants.
+    '''
+    print('VIEW COUNT (%d ants)' % len(world.own_ants))
+    before = world.map.planes[OWN_ANTS]
+    for moving in (1.0, 0.25):
+        rnd = Random(42)
+        after = zeros(before.shape, dtype=bool)
+        for col, row in zip(*nonzero(before)):
+            d_col, d_row = (0, 0)
+            if rnd.random() < moving:
+                d_col, d_row = rnd.choice(((0, -1), (1, 0), (0, 1), (-1, 0)))
+            after[(col + d_col) % world.cols,
+                  (row + d_row) % world.rows] = True
+        start = time()
+        for i in range(repeat):
+            full = dilate_count(after, world.view_runs)
+        legacy = (time() - start) * 1000 / repeat
+        world.view_count = dilate_count(before, world.view_runs)
+        start = time()
+        for i in range(repeat):
+            world._update_view_count(before, after)
+            world._update_view_count(after, before)
+        current = (time() - start) * 1000 / repeat / 2
+        world._update_view_count(before, after)
+        assert (full == world.view_count).all()
+        print('  %3d%% moving, dilation : %.2f ms' % (moving * 100, legacy))
+        print('  %3d%% moving, crescents: %.2f ms' % (moving * 100, current))
+
+
+def bench_queries(world, repeat=5):
+    '''
+    Milliseconds to find the own ants engageable by each enemy ant: one call
+    per enemy vs one batch call.
+    '''
+    enemies = world.enemy_ants.keys()
+    start = time()
+    for i in range(repeat):
+        for enemy in enemies:
+            world.get_engageable(enemy)
+    legacy = (time() - start) * 1000 / repeat
+    start = time()
+    for i in range(repeat):
+        world.get_engageable_batch(enemies)
+    current = (time() - start) * 1000 / repeat
+    print('ENGAGEABLE QUERIES (%d enemies)' % len(enemies))
+    print('  per enemy   : %.2f ms' % legacy)
+    print('  batch       : %.2f ms' % current)
+
+
+def bench_spatial(world, repeat=5):
+    '''
+    Milliseconds to find the food in view of each own ant: mask gather over
+    the map vs bucket grid.
+    '''
+    ants = world.own_ants.keys()
+    radius2 = world.viewradius2
+    start = time()
+    for i in range(repeat):
+        for ant in ants:
+            world.get_stuff_in_sight(ant, FOOD)
+    legacy = (time() - start) * 1000 / repeat
+    start = time()
+    for i in range(repeat):
+        for ant in ants:
+            world.get_nearby(ant, FOOD, radius2)
+    current = (time() - start) * 1000 / repeat
+    print('FOOD IN SIGHT (%d ants, %d food)' % (len(ants), len(world.food)))
+    print('  mask gather : %.2f ms' % legacy)
+    print('  bucket grid : %.2f ms' % current)
+
+
+def legacy_threat(world):
+    '''
+    The threat plane computed one enemy and one legal move at a time, as
+    `Bot.attack` did with `get_in_attackradius` calls.
+    '''
+    threat = zeros(world.world_size, dtype=int)
+    mask = world.attack_mask
+    for enemy in world.enemy_ants:
+        reach = zeros(world.world_size, dtype=bool)
+        for dest, direction in world.get_legal_moves(enemy):
+            reach[(mask[0] + dest[0]) % world.cols,
+                  (mask[1] + dest[1]) % world.rows] = True
+        threat += reach
+    return threat
+
+
+def bench_threat(world, repeat=5):
+    '''
+    Milliseconds to compute the threat plane: per enemy vs grouped dilations.
+    '''
+    start = time()
+    for i in range(repeat):
+        legacy_threat(world)
+    legacy = (time() - start) * 1000 / repeat
+    start = time()
+    for i in range(repeat):
+        world._update_threat()
+    current = (time() - start) * 1000 / repeat
+    print('THREAT (%d enemies)' % len(world.enemy_ants))
+    print('  per enemy   : %.2f ms' % legacy)
+    print('  dilations   : %.2f ms' % current)
+
+
+def legacy_resolve(locs, owners, radius2):
+    '''
+    The focus rule applied to one configuration at a time, ant by ant.
+    '''
+    alive = [locs.count(loc) == 1 for loc in locs]
+    in_range = [[j for j in range(len(locs)) if alive[i] and alive[j] and
+                 owners[i] != owners[j] and
+                 (locs[i][0] - locs[j][0]) ** 2 +
+                 (locs[i][1] - locs[j][1]) ** 2 <= radius2]
+                for i in range(len(locs))]
+    return [not alive[i] or
+            any([len(in_range[j]) <= len(in_range[i]) for j in in_range[i]])
+            for i in range(len(locs))]
+
+
+def bench_combat(world, configurations=5000):
+    '''
+    Configurations per millisecond resolved by the combat simulator, for a
+    3 vs 3 fight: one configuration at a time vs all at once.
+    '''
+    locs = array([(0, 0), (1, 2), (2, 1), (3, 0), (4, 3), (2, 3)])
+    owners = array([0, 0, 0, 1, 1, 1])
+    moves = RandomState(42).randint(0, 5, (len(locs), configurations))
+    cols, rows = apply_moves(locs, moves, world.world_size, MOVE_OFFSETS)
+    start = time()
+    for config in range(configurations):
+        legacy_resolve(zip(cols[:, config], rows[:, config]), owners,
+                       world.attackradius2)
+    legacy = configurations / ((time() - start) * 1000)
+    start = time()
+    cols, rows = apply_moves(locs, moves, world.world_size, MOVE_OFFSETS)
+    resolve_battles(cols, rows, owners, world.attackradius2)
+    current = configurations / ((time() - start) * 1000)
+    print('COMBAT (3 vs 3, %d configurations)' % configurations)
+    print('  one by one  : %.1f configurations/ms' % legacy)
+    print('  vectorised  : %.1f configurations/ms' % current)
+
+
+def legacy_assign(dests, scores):
+    '''
+    The greedy assignment formerly done by `Bot.explore`: each ant in turn
+    takes its best tile not taken yet.
+    '''
+    taken = set()
+    columns = []
+    for options, values in zip(dests.tolist(), scores.tolist()):
+        for column in sorted(range(len(options)), key=lambda c: -values[c]):
+            if options[column] not in taken and values[column] > -inf:
+                taken.add(options[column])
+                columns.append(column)
+                break
+        else:
+            columns.append(-1)
+    return columns
+
+
+def bench_assignment(world, repeat=10):
+    '''
+    Milliseconds and total score of the explore assignment: greedy vs
+    auction (all the ants competing for their 5 tiles, own tiles free).
+    '''
+    ants = world.own_ants.keys()
+    rankings, dests = world.get_scent_rankings(ants, H_EXPLORE)
+    scents = world.map.planes[H_EXPLORE].ravel()[dests]
+    scores = log1p(scents) - log1p(scents[:, :1])
+    scores[~(world.get_passable()[dests] | (rankings == 0))] = -inf
+    results = []
+    for function in (legacy_assign, assign):
+        start = time()
+        for i in range(repeat):
+            columns = array(function(dests, scores))
+        total = scores[arange(len(ants)), columns][columns >= 0].sum()
+        results.append(((time() - start) * 1000 / repeat, total))
+    print('ASSIGNMENT (%d ants)' % len(ants))
+    print('  greedy      : %.2f ms (score %.1f)' % results[0])
+    print('  auction     : %.2f ms (score %.1f)' % results[1])
+
+
+def bfs_harvest(bot):
+    '''
+    The harvest phase planned with a single breadth-first search from all the
+    food: each food is matched with the closest free ant among those it is the
+    closest food of, which steps along the shortest path. Kept as a reference:
+    the search alone costs more than the per-food queries of `Bot.harvest`,
+    and it sends fewer ants.
+    '''
+    world = bot.world
+    destinations = bot.destinations
+    own_ants = bot.ants_to_process
+    foods = world.food.keys()
+    ants = list(own_ants)
+    if not foods or not ants:
+        return
+    reach = int((2 * world.viewradius2) ** 0.5)
+    foods = world.get_flat_indices(foods)
+    distance, origin = world.get_distances(foods, reach)
+    locs = world.get_flat_indices(ants)
+    ant_distance, ant_origin = distance[locs], origin[locs]
+    # the closest ant of each food (the first, sorted by food & distance)
+    order = lexsort((ant_distance, ant_origin))
+    order = order[ant_origin[order] >= 0]
+    first = ones(len(order), dtype=bool)
+    first[1:] = ant_origin[order][1:] != ant_origin[order][:-1]
+    chosen = order[first]
+    # steps along the shortest path lead to tiles one tile closer
+    dests = world.neighbours[locs[chosen]]
+    closer = distance[dests] == ant_distance[chosen, None] - 1
+    passable = world.get_passable()
+    for index, options, steps in zip(chosen.tolist(), dests.tolist(),
+                                     closer.tolist()):
+        ant = ants[index]
+        if ant_distance[index] == 1:
+            destinations.add(options[0])
+            own_ants.remove(ant)
+            continue
+        for move, dest, step in zip(MOVES[1:], options[1:], steps[1:]):
+            if step and not dest in destinations and passable[dest]:
+                world.issue_order((ant, move))
+                destinations.add(dest)
+                own_ants.remove(ant)
+                break
+
+
+def bench_harvest(world, repeat=10):
+    '''
+    Milliseconds of the harvest phase: per food queries vs BFS planner.
+    '''
+    bot = Bot(world)
+    results = []
+    for harvest in (Bot.harvest, bfs_harvest):
+        start = time()
+        for i in range(repeat):
+            bot.ants_to_process = set(world.own_ants)
+            bot.destinations = set()
+            world.orders_count = 0
+            harvest(bot)
+        results.append(((time() - start) * 1000 / repeat,
+                        len(world.own_ants) - len(bot.ants_to_process)))
+    world.orders_count = 0
+    print('HARVEST (%d food, %d ants)' % (len(world.food),
+                                         len(world.own_ants)))
+    print('  per food    : %.2f ms (%d harvesters)' % results[0])
+    print('  bfs planner : %.2f ms (%d harvesters)' % results[1])
+
+
+def bench_pathfinding(world, paths=20):
+    '''
+    Milliseconds per path between random land tiles: A* search vs cache.
+    '''
+    rnd = Random(42)
+    land = nonzero(~world.map.planes[WATER].ravel())[0].tolist()
+    pairs = [(rnd.choice(land), rnd.choice(land)) for i in range(paths)]
+    finder = world.pathfinder
+    lengths = []
+    start = time()
+    for source, target in pairs:
+        lengths.append(len(finder.get_path(source, target) or ()))
+    search = (time() - start) * 1000 / paths
+    start = time()
+    for source, target in pairs:
+        finder.get_path(source, target)
+    cached = (time() - start) * 1000 / paths
+    print('PATHFINDING (%d paths, %.0f tiles long on average)' %
+          (paths, float(sum(lengths)) / paths))
+    print('  a* search   : %.2f ms' % search)
+    print('  cache       : %.3f ms' % cached)
+
+
+def bench_scent_mask(world, repeat=20):
+    '''
+    Milliseconds to build the scent mask: per-layer scan vs matrix products.
+    '''
+    start = time()
+    for i in range(repeat):
+        legacy_scent_mask(world)
+    legacy = (time() - start) * 1000 / repeat
+    start = time()
+    for i in range(repeat):
+        world._get_scent_mask()
+    current = (time() - start) * 1000 / repeat
+    print('SCENT MASK (%dx%d)' % (world.cols, world.rows))
+    print('  layer scan  : %.2f ms' % legacy)
+    print('  products    : %.2f ms' % current)
+
+
+def bench_diffusion(world, steps=100):
+    '''
+    Passes per millisecond of the legacy loop vs the `Diffuser` engine.
+    '''
+    start = time()
+    legacy_diffuse(world, steps)
+    legacy_rate = steps / ((time() - start) * 1000)
+    world.turn_start_time = time()
+    world.turntime = 10 ** 9  # never stop because of the clock
+    world.turns_left = steps - world.attackradiusint - 5
+    world.diffuse()
+    print('DIFFUSION (%dx%d, %d passes)' % (world.cols, world.rows, steps))
+    print('  legacy loop : %.2f passes/ms' % legacy_rate)
+    print('  diffuser    : %.2f passes/ms' % world.diffuser.rate)
+
+
+def bench_backends(world):
+    '''
+    Milliseconds needed by each diffusion backend to reach a steady state.
+    '''
+    print('DIFFUSION BACKENDS (%dx%d)' % (world.cols, world.rows))
+    world.turntime = 10 ** 9
+    world.turns_left = 10 ** 5
+    for name, backend in (('jacobi', JACOBI), ('sparse', SPARSE),
+                          ('bfs', BFS)):
+        world.turn_start_time = start = time()
+        world.diffuse(warm=False, backend=backend)
+        print('  %-11s : %d ms (%d passes)' % (name,
+              (time() - start) * 1000, world.diffuser.passes))
+
+
+def bench_map(world, repeat=100):
+    '''
+    Per-turn map reset: interleaved float64 array vs per-layer planes.
+    '''
+    interleaved = zeros(world.map.shape)
+    start = time()
+    for i in range(repeat):
+        interleaved[..., 1:] = 0
+    legacy = (time() - start) * 1000 / repeat
+    start = time()
+    for i in range(repeat):
+        for plane in world.map.planes[1:]:
+            plane.fill(0)
+    current = (time() - start) * 1000 / repeat
+    print('MAP RESET (%dx%d)' % (world.cols, world.rows))
+    print('  interleaved : %.3f ms (%d bytes)' % (legacy, interleaved.nbytes))
+    print('  planes      : %.3f ms (%d bytes)' %
+          (current, sum([plane.nbytes for plane in world.map.planes])))
+
+
+def run_all(recorded_input=None):
+    '''
+    Run all the benchmarks.
+    '''
+    bench_parser(recorded_input)
+    world = get_world()
+    bench_map(world)
+    bench_view_counter(world)
+    bench_view_count(world)
+    bench_queries(world)
+    bench_spatial(world)
+    bench_threat(world)
+    bench_combat(world)
+    bench_scent_mask(world)
+    bench_orders(world)
+    diffused = get_world()  # untouched by the benchmarks above
+    diffused.turntime = 10 ** 9
+    diffused.diffuse()
+    bench_assignment(diffused)
+    bench_harvest(diffused)
+    bench_pathfinding(world)
+    bench_diffusion(world)
+    bench_backends(get_world(ants=20))
+
+if __name__ == '__main__':
+    run_all(*sys.argv[1:2])
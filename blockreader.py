@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+
+'''
+Contest entry for the Fall 2011 challenge on http://aichallenge.org
+
+This file contains the input layer between the game engine and the bot. The
+engine input is read in large chunks straight from the stdin file descriptor,
+and split into whole blocks (the lines preceding a ``ready`` or ``go`` line),
+which is the only unit of input the bot is interested in.
+'''
+
+import os
+import re
+import sys
+
+__author__ = "Mac Ryan"
+__copyright__ = "Copyright 2011, Mac Ryan"
+__license__ = "GPL v3"
+#__version__ = "<dev>"
+#__date__ = "<unknown>"
+__maintainer__ = "Mac Ryan"
+__email__ = "quasipedia@gmail.com"
+__status__ = "Development"
+
+
+# Bytes requested to the OS at each read (the first turn of a 200x200 map can
+# be a few hundred kB, later turns usually fit in a single chunk).
+CHUNK_SIZE = 2 ** 16
+
+# The line closing a block (`ready` after the setup, `go` after each turn).
+BLOCK_END = re.compile(r'^[ \t]*(ready|go)[ \t\r]*\n', re.M)
+
+# Longest possible partial terminator left unscanned at the end of the buffer
+# (a terminator split between two chunks must be searched again).
+TAIL = len('ready\r\n')
+
+
+class BlockReader(object):
+
+    '''
+    Read the engine input from a file descriptor into a reusable buffer, and
+    return it one block at a time. Blocks are returned as raw strings
+    (lowercase, lines separated by newlines), without their terminator.
+    '''
+
+    def __init__(self, fd=None, chunk_size=CHUNK_SIZE):
+        self.fd = sys.stdin.fileno() if fd is None else fd
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.scanned = 0  # buffer bytes already known not to end a block
+
+    def read_block(self):
+        '''
+        Return a tuple (terminator, block) for the next complete block, where
+        terminator is either 'ready' or 'go'. Raise EOFError when the stream
+        ends (any incomplete block left in the buffer is discarded).
+        '''
+        buffer = self.buffer
+        while True:
+            match = BLOCK_END.search(buffer, max(0, self.scanned - TAIL))
+            if match:
+                block = bytes(buffer[:match.start()])
+                terminator = bytes(match.group(1))
+                del buffer[:match.end()]
+                self.scanned = 0
+                return terminator, block
+            self.scanned = len(buffer)
+            chunk = os.read(self.fd, self.chunk_size)
+            if not chunk:
+                raise EOFError('End of engine input')
+            buffer += chunk.lower()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+
+'''
+Contest entry for the Fall 2011 challenge on http://aichallenge.org
+
+This file contains the combat logic shared by the bot phases. Fights are split
+in independent battle groups: the connected components of the bipartite
+"engagement graph", in which an own ant and an enemy ant are linked if they
+might fight next turn (see `World.get_engageable`). Each group can then be
+analysed on its own, at a cost proportional to the size of the fight rather
+than to the size of the armies.
+'''
+
+from time import time
+from itertools import product
+
+from numpy import array, arange, zeros, unique, minimum, column_stack, \
+                  argsort, bincount, cumsum, asarray, eye, int16, \
+                  concatenate, repeat, tile, lexsort, in1d, flatnonzero
+from numpy.random import RandomState
+
+from world import MOVE_OFFSETS, OWN_ANTS
+
+__author__ = "Mac Ryan"
+__copyright__ = "Copyright 2011, Mac Ryan"
+__license__ = "GPL v3"
+#__version__ = "<dev>"
+#__date__ = "<unknown>"
+__maintainer__ = "Mac Ryan"
+__email__ = "quasipedia@gmail.com"
+__status__ = "Development"
+
+
+# Value of each enemy killed and of each own ant lost in a battle (losses
+# weigh a bit more: a fair trade is only good for the side with more ants).
+KILL_VALUE = 1.0
+LOSS_VALUE = 1.2
+
+# Fraction of the time left at the start of the attack phase that is shared
+# among the battle groups (the rest goes to diffusion and the other phases).
+COMBAT_TIME_SHARE = 0.3
+
+# Upper bound to the pairs of ants (A x A x configurations) examined by each
+# round of the battle search: it keeps a single round within a few ms.
+SEARCH_CELLS = 2 ** 18
+
+# Milliseconds needed to evaluate a pair of ants in a configuration, before
+# the first round of a search measures it (a pessimistic guess: ~10 ns are
+# the norm). Rounds that would not end in time are not started.
+CELL_COST = 2e-5
+
+# Upper bound to the number of own and enemy candidate move sets kept by the
+# battle search between rounds.
+MAX_CANDIDATES = 32
+
+# The battle search stops once this many rounds in a row haven't improved the
+# best worst case (the time left goes back to the rest of the turn).
+SEARCH_PATIENCE = 3
+
+class BattleGroup(object):
+
+    '''
+    The ants involved in one independent fight:
+    - own     : N x 2 array of own ants locations
+    - enemies : M x 2 array of enemy ants locations
+    - edges   : K x 2 array of (own, enemy) engaged pairs, as indices in the
+                two arrays above
+    '''
+
+    def __init__(self, own, enemies, edges):
+        self.own = own
+        self.enemies = enemies
+        self.edges = edges
+
+    def __len__(self):
+        return len(self.own) + len(self.enemies)
+
+    def __repr__(self):
+        return '<BattleGroup: %d own vs %d enemies>' % (len(self.own),
+                                                      len(self.enemies))
+
+
+def apply_moves(locs, moves, world_size, offsets):
+    '''
+    Return the positions of the A ants in `locs` after performing the moves
+    in the A x C array `moves` (indices into `offsets`, e.g. MOVE_OFFSETS),
+    one column per configuration. Positions are returned as two A x C arrays
+    (cols and rows) relative to the starting position of the first ant, and
+    not wrapped: battle groups are assumed to span less than half the map.
+    '''
+    world_size = asarray(world_size)
+    relative = (asarray(locs) - locs[0] + world_size // 2) % world_size - \
+               world_size // 2
+    relative = relative.astype(int16)
+    offsets = asarray(offsets, dtype=int16)
+    return relative[:, :1] + offsets[:, 0][moves], \
+           relative[:, 1:] + offsets[:, 1][moves]
+
+
+def resolve_battles(cols, rows, owners, radius2):
+    '''
+    Apply the rules of the game to C configurations of A ants at once, and
+    return an A x C boolean array of the ants that die. `cols` and `rows` are
+    the A x C (unwrapped) positions of the ants after their moves, as
+    returned by `apply_moves`, `owners` the A owners of the ants.
+    The rules are:
+    - ants ending their move on the same tile all die (collisions)
+    - the surviving ants fight: each ant is "weakened" by the number of
+      enemies within `radius2` from it, and it dies if any of those enemies is
+      as weak or weaker than itself (focus rule)
+    Everything is computed on A x A x C arrays of pairs, with the
+    configurations on the last (contiguous) axis, so that all the reductions
+    over ants are plain additions of C-long vectors.
+    '''
+    owners = asarray(owners)
+    enemies = (owners[:, None] != owners[None, :])[:, :, None]
+    others = ~eye(len(owners), dtype=bool)[:, :, None]
+    d_cols = cols[:, None, :] - cols[None, :, :]
+    d_rows = rows[:, None, :] - rows[None, :, :]
+    distances2 = d_cols * d_cols + d_rows * d_rows
+    collided = ((distances2 == 0) & others).any(axis=1)
+    alive = ~collided
+    fighting = (distances2 <= radius2) & enemies & \
+               alive[:, None, :] & alive[None, :, :]
+    weakness = fighting.sum(axis=1, dtype=int16)
+    # an ant dies if one of the enemies in range is not weaker than itself
+    focus = fighting & (weakness[None, :, :] <= weakness[:, None, :])
+    return collided | focus.any(axis=1)
+
+
+def search_battle(world, group, stop_at, reserved=(), random=None):
+    '''
+    Anytime maximin search of the moves of the own ants in `group`, running
+    until `world.time_remaining()` drops to `stop_at` milliseconds. Each
+    round is a sampled best-response step: new own move sets (mutations of
+    the best one and random ones) and new enemy responses are evaluated
+    against each other with `resolve_battles`, then only the own move sets
+    with the best worst case and the enemy responses hurting them most are
+    kept for the next round. Among move sets with the same worst case, the
+    ones bringing the own ants closer to the enemies are preferred, so that
+    ants don't freeze when staying is not better than advancing. Own ants
+    never move on the flat indices in `reserved`, nor on tiles of own ants
+    outside the group.
+    The search stops early when SEARCH_PATIENCE rounds in a row don't improve
+    the best worst case. Battles small enough for all the move sets of both
+    sides to fit in a round are solved exactly, with that single round.
+    Return the moves of the own ants (indices in MOVES) of the best move set
+    found, and its value (kills minus losses, in the worst case found). If no
+    round can end in time (as for a very large group), all the ants stay and
+    the value is None.
+    '''
+    if random is None:
+        random = RandomState()
+    n_own = len(group.own)
+    locs = concatenate((group.own, group.enemies))
+    best = zeros(n_own, dtype=int)
+    # each round pits up to 3 x size own move sets against 2 x size enemy
+    # ones (size is rounded down to keep rounds below SEARCH_CELLS pairs)
+    size = int((SEARCH_CELLS / 6.0) ** 0.5) // len(locs)
+    size = min(MAX_CANDIDATES, max(1, size))
+    cell_cost = CELL_COST
+    if world.time_remaining() - _get_cells(1, 1, size, len(locs)) * \
+       cell_cost <= stop_at:
+        return best, None  # not even worth setting the search up
+    owners = array([0] * n_own + [world.enemy_ants[tuple(enemy)] for enemy in
+                                  group.enemies.tolist()])
+    dests, own_legal = world.get_legal_moves_all(group.own)
+    blocked = world.map.planes[OWN_ANTS].ravel()[dests] & \
+              ~in1d(dests, dests[:, 0]).reshape(dests.shape)
+    blocked |= in1d(dests, list(reserved)).reshape(dests.shape)
+    own_legal &= ~blocked
+    own_legal[:, 0] = True
+    enemy_legal = world.get_legal_moves_all(group.enemies)[1]
+    approach = _get_approach(world, dests, group.enemies)
+    own_space = own_legal.sum(axis=1).prod(dtype=float)
+    enemy_space = enemy_legal.sum(axis=1).prod(dtype=float)
+    cells = own_space * enemy_space * len(locs) ** 2
+    if cells <= SEARCH_CELLS:
+        if world.time_remaining() - cells * cell_cost <= stop_at:
+            return best, None
+        own, enemies = _enumerate(own_legal), _enumerate(enemy_legal)
+        payoff = _evaluate(world, locs, owners, own, enemies)
+        first = _rank(approach, own, payoff)[0]
+        return own[:, first], payoff[first].min()
+    value = None
+    own = best.reshape(-1, 1)
+    enemies = zeros((len(group.enemies), 1), dtype=int)
+    stalled = 0
+    while stalled < SEARCH_PATIENCE:
+        # a round can't be interrupted: only start it if it ends in time
+        cells = _get_cells(own.shape[1], enemies.shape[1], size, len(locs))
+        if world.time_remaining() - cells * cell_cost <= stop_at:
+            break
+        start = time()
+        own = concatenate((own, _mutate(best, own_legal, size, random),
+                           _sample(own_legal, size, random)), axis=1)
+        enemies = concatenate((enemies,
+                               _sample(enemy_legal, size, random)), axis=1)
+        payoff = _evaluate(world, locs, owners, own, enemies)
+        # own move sets by worst case, enemy responses by damage to the best
+        # own move set (and on average to the others)
+        ranking = _rank(approach, own, payoff)[:size]
+        payoff = payoff[ranking]
+        responses = lexsort((payoff.mean(axis=0), payoff[0]))[:size]
+        own, enemies = own[:, ranking], enemies[:, responses]
+        previous = value
+        best, value = own[:, 0], payoff[0, responses[0]]
+        stalled = 0 if previous is None or value > previous else stalled + 1
+        cell_cost = (time() - start) * 1000.0 / cells
+    return best, value
+
+
+def _rank(approach, own, payoff):
+    '''
+    Return the indices of the own move sets (the columns of `own`) sorted by
+    decreasing worst case in the `payoff` matrix, then by increasing distance
+    from the enemies (the sum of the `approach` distances of their moves).
+    '''
+    distances = approach[arange(len(own)).reshape(-1, 1), own].sum(axis=0)
+    return lexsort((distances, -payoff.min(axis=1)))
+
+
+def _enumerate(legal):
+    '''
+    Return all the move sets (as columns) of the ants whose legal moves are in
+    the N x 5 boolean array `legal`.
+    '''
+    moves = product(*[flatnonzero(row).tolist() for row in legal])
+    return array(list(moves), dtype=int).reshape(-1, len(legal)).T
+
+
+def _get_cells(n_own_sets, n_enemy_sets, size, n_ants):
+    '''
+    Return the number of (ant, ant, configuration) cells evaluated by a round
+    of the battle search keeping `n_own_sets` and `n_enemy_sets` move sets
+    from the previous round, among `n_ants` ants.
+    '''
+    return (n_own_sets + 2 * size) * (n_enemy_sets + size) * n_ants ** 2
+
+
+def _get_approach(world, dests, enemies):
+    '''
+    Return the N x 5 array of the taxicab distances between the flat
+    destinations `dests` of the moves of N ants and the closest of the
+    `enemies` locations.
+    '''
+    cols, rows = divmod(dests, world.rows)
+    d_cols = abs(cols[:, :, None] - enemies[:, 0])
+    d_rows = abs(rows[:, :, None] - enemies[:, 1])
+    d_cols = minimum(d_cols, world.cols - d_cols)
+    d_rows = minimum(d_rows, world.rows - d_rows)
+    return (d_cols + d_rows).min(axis=-1)
+
+
+def _sample(legal, size, random):
+    '''
+    Return `size` random move sets (as columns) for the ants whose legal
+    moves are in the N x 5 boolean array `legal`.
+    '''
+    weights = random.random_sample((len(legal), legal.shape[1], size))
+    return (weights * legal[:, :, None]).argmax(axis=1)
+
+
+def _mutate(moves, legal, size, random):
+    '''
+    Return `size` copies of the move set `moves`, each with the move of a
+    random ant replaced by a random legal one.
+    '''
+    mutants = repeat(moves.reshape(-1, 1), size, axis=1)
+    ants, configs = random.randint(0, len(moves), size), arange(size)
+    mutants[ants, configs] = _sample(legal, size, random)[ants, configs]
+    return mutants
+
+
+def _evaluate(world, locs, owners, own, enemies):
+    '''
+    Return the P x Q payoff matrix of the P own move sets in `own` against
+    the Q enemy move sets in `enemies`, in kills minus losses.
+    '''
+    n_own, (p, q) = len(own), (own.shape[1], enemies.shape[1])
+    moves = concatenate((repeat(own, q, axis=1), tile(enemies, (1, p))))
+    cols, rows = apply_moves(locs, moves, world.world_size, MOVE_OFFSETS)
+    dead = resolve_battles(cols, rows, owners, world.attackradius2)
+    return (KILL_VALUE * dead[n_own:].sum(axis=0) -
+            LOSS_VALUE * dead[:n_own].sum(axis=0)).reshape(p, q)
+
+
+def find_components(size, edges):
+    '''
+    Union-find over `size` nodes linked by the K x 2 array `edges`, with all
+    the unions of a round performed at once: each edge hooks the larger of
+    its two roots under the smaller one, then paths are compressed by pointer
+    jumping, until no edge links two different roots.
+    Return the root (the smallest node) of the component of each node.
+    '''
+    parent = arange(size)
+    while True:
+        # full path compression
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+        roots = parent[edges]
+        crossing = roots[:, 0] != roots[:, 1]
+        if not crossing.any():
+            return parent
+        roots = roots[crossing]
+        low, high = roots.min(axis=1), roots.max(axis=1)
+        # hook each root under the smallest root it is linked to
+        minimum.at(parent, high, low)
+
+
+def get_battle_groups(world):
+    '''
+    Return the list of the BattleGroup's of the current turn, largest first.
+    The engagement graph is built with a single batched query.
+    '''
+    enemies = array(world.enemy_ants.keys(), dtype=int).reshape(-1, 2)
+    enemy_index, owns = world.get_engageable_batch(enemies)
+    if not len(enemy_index):
+        return []
+    # compact numbering of the nodes: own ants first, then enemies
+    own_ids, own_index = unique(world.get_flat_indices(owns),
+                                return_inverse=True)
+    enemy_ids, enemy_index = unique(enemy_index, return_inverse=True)
+    own_locs = column_stack(divmod(own_ids, world.rows))
+    enemy_locs = enemies[enemy_ids]
+    edges = column_stack((own_index, enemy_index + len(own_ids)))
+    roots = find_components(len(own_ids) + len(enemy_ids), edges)
+    # group the nodes and the edges by component: each is sorted by group,
+    # and the group of index `g` is the slice starts[g]:starts[g + 1]
+    n_own = len(own_ids)
+    labels, node_group = unique(roots, return_inverse=True)
+    own_order, own_starts = _sort_by_group(node_group[:n_own], len(labels))
+    enemy_order, enemy_starts = _sort_by_group(node_group[n_own:],
+                                               len(labels))
+    edge_order, edge_starts = _sort_by_group(node_group[edges[:, 0]],
+                                             len(labels))
+    # index of each node within its group
+    local = zeros(len(node_group), dtype=int)
+    local[own_order] = arange(n_own) - own_starts[node_group[own_order]]
+    local[n_own + enemy_order] = arange(len(enemy_ids)) - \
+        enemy_starts[node_group[n_own + enemy_order]]
+    own_locs = own_locs[own_order]
+    enemy_locs = enemy_locs[enemy_order]
+    edges = local[edges[edge_order]]
+    groups = [BattleGroup(own_locs[own_starts[g]:own_starts[g + 1]],
+                          enemy_locs[enemy_starts[g]:enemy_starts[g + 1]],
+                          edges[edge_starts[g]:edge_starts[g + 1]])
+              for g in range(len(labels))]
+    groups.sort(key=len, reverse=True)
+    return groups
+
+
+def _sort_by_group(groups, n_groups):
+    '''
+    Return the order sorting the items by `groups` (stable) and the start of
+    each group in the sorted items (with the total appended).
+    '''
+    starts = zeros(n_groups + 1, dtype=int)
+    cumsum(bincount(groups, minlength=n_groups), out=starts[1:])
+    return argsort(groups, kind='mergesort'), starts
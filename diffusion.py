@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+
+'''
+Contest entry for the Fall 2011 challenge on http://aichallenge.org
+
+This file contains the diffusion engines that spread the hormones over the map.
+
+The engines work on HORMONES x COLS x ROWS arrays (one contiguous plane per
+hormone) and look for the same fixed point: every tile holds ¼ of the sum of
+its four neighbours, plus the scent of the emitter it hosts, while opaque tiles
+are forced to zero. Available backends:
+- JACOBI : time-bounded Jacobi iterations (``Diffuser``). All the working
+           memory is allocated once, when the engine is created: the main loop
+           only uses views and the ``out=`` argument of numpy's ufuncs, so it
+           does not allocate a single array, whatever the number of passes.
+- SPARSE : solve the steady state as a sparse linear system
+           (``SparseDiffuser``). Requires scipy.
+- BFS    : exact geodesic propagation, one multi-source breadth-first search
+           per hormone (``DistanceDiffuser``). Rather than the Jacobi sum of
+           all emitters, each tile gets the strongest emitter's scent decayed
+           by ¼ per tile of actual path: ``max(e * 0.25 ** distance)``.
+'''
+
+from time import time
+
+from numpy import zeros, arange, add, subtract, multiply, divide, absolute, \
+                  logical_not, log, power, flatnonzero
+from numpy.linalg import norm
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.linalg import cg
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+from utils import get_neighbour_table, multi_source_bfs
+
+__author__ = "Mac Ryan"
+__copyright__ = "Copyright 2011, Mac Ryan"
+__license__ = "GPL v3"
+#__version__ = "<dev>"
+#__date__ = "<unknown>"
+__maintainer__ = "Mac Ryan"
+__email__ = "quasipedia@gmail.com"
+__status__ = "Development"
+
+
+# BACKENDS
+JACOBI = 0
+SPARSE = 1
+BFS = 2
+
+# Convergence is tested every CHECK_INTERVAL passes, as measuring the residual
+# costs about half a pass.
+CHECK_INTERVAL = 4
+# Added to the denominator of the relative residual to avoid divisions by 0.
+TINY = 1e-300
+# Added to the diagonal of the sparse system, so that it stays non-singular
+# even in regions of the map without any opaque tile.
+REGULARISATION = 1e-6
+
+
+def get_stencil(source, dest):
+    '''
+    Return a list of (out, operand1, operand2) views that - once each triplet
+    has been fed to ``numpy.add`` - leave in ``dest`` the sum of the four
+    neighbours of each tile of ``source``, wrapping around the torus.
+    The two last axis of the arrays must be COLS and ROWS.
+    '''
+    s, d = source, dest
+    return [
+        # west + east neighbours (first write, so no need to zero `dest`)
+        (d[..., 1:-1, :], s[..., :-2, :], s[..., 2:, :]),
+        (d[..., 0, :], s[..., -1, :], s[..., 1, :]),
+        (d[..., -1, :], s[..., -2, :], s[..., 0, :]),
+        # north + south neighbours
+        (d[..., 1:-1], d[..., 1:-1], s[..., :-2]),
+        (d[..., 1:-1], d[..., 1:-1], s[..., 2:]),
+        (d[..., 0], d[..., 0], s[..., -1]),
+        (d[..., 0], d[..., 0], s[..., 1]),
+        (d[..., -1], d[..., -1], s[..., -2]),
+        (d[..., -1], d[..., -1], s[..., 0]),
+    ]
+
+
+class Diffuser(object):
+
+    '''
+    Jacobi diffusion engine with preallocated ping-pong buffers.
+
+    Usage: call ``prepare()`` once per turn with the emitters and blockers of
+    that turn, then ``run()``. The result is available in ``field``, while
+    ``passes``, ``hormone_passes``, ``residuals``, ``converged`` and ``rate``
+    (passes per millisecond) describe the last run.
+
+    Each hormone plane is iterated separately, so that a hormone can stop as
+    soon as its residual (the largest relative change of a tile during a pass)
+    falls below the tolerance, while the others keep diffusing.
+    '''
+
+    def __init__(self, cols, rows, hormones=3):
+        shape = (hormones, cols, rows)
+        self.buffers = (zeros(shape), zeros(shape))
+        self.emitters = zeros(shape)
+        self.previous_emitters = zeros(shape)
+        self.passable = zeros(shape, dtype=bool)
+        self.conductance = zeros(shape)
+        self.scratch = (zeros(shape[1:]), zeros(shape[1:]))
+        # The stencil views are bound to the buffers, so they can be computed
+        # once and for all, for each hormone and each direction of the
+        # ping-pong.
+        a, b = self.buffers
+        self.stencils = ([get_stencil(a[h], b[h]) for h in range(hormones)],
+                         [get_stencil(b[h], a[h]) for h in range(hormones)])
+        self.toggler = 0  # index of the buffer holding the last field
+        self.field = a
+        self.warm = False  # True once there is a field to warm-start from
+        self.passes = 0
+        self.hormone_passes = [0] * hormones
+        self.residuals = [0.0] * hormones
+        self.converged = False
+        self.rate = 0.0
+
+    def prepare(self, emitters, opaque):
+        '''
+        Load the emitters and the blockers for the current turn.
+        - emitters : HORMONES x COLS x ROWS array of emitted scent (>= 0)
+        - opaque   : HORMONES x COLS x ROWS boolean array, True where the
+                     scent must be removed
+        '''
+        # The blockers are folded into the ¼ multiplier (0 where opaque), and
+        # the emitters on opaque tiles are removed: a pass is then just
+        # ``dest = sum_of_neighbours * conductance + emitters``.
+        # Last turn's emitters are kept to warm-start the next run.
+        self.emitters, self.previous_emitters = \
+            self.previous_emitters, self.emitters
+        passable = self.passable
+        logical_not(opaque, out=passable)
+        multiply(passable, 0.25, out=self.conductance)
+        multiply(emitters, passable, out=self.emitters)
+
+    def run(self, hard_time_limit, max_steps, warm=False, tolerance=0):
+        '''
+        Diffuse until either ``time()`` reaches ``hard_time_limit``,
+        ``max_steps`` passes have been performed, or all hormones have
+        converged within ``tolerance``. Return the number of passes.
+        If ``warm`` is True, the diffusion starts from the field of the
+        previous run rather than from the bare emitters.
+        '''
+        conductance = self.conductance
+        emitters = self.emitters
+        buffers = self.buffers
+        toggler = self.toggler
+        seed = buffers[toggler]
+        if warm and self.warm:
+            # The previous field is already the (near) fixed point for the
+            # previous emitters: correct it for the emitters that appeared,
+            # vanished or changed, and for the tiles that became opaque.
+            add(seed, emitters, out=seed)
+            subtract(seed, self.previous_emitters, out=seed)
+            multiply(seed, self.passable, out=seed)
+        else:
+            seed[...] = emitters  # seed with the emitters' own smell
+        active = list(range(len(emitters)))
+        hormone_passes = self.hormone_passes
+        residuals = self.residuals
+        for h in active:
+            hormone_passes[h] = 0
+            residuals[h] = float('inf')
+        counter = 0
+        start = time()
+        while active and counter < max_steps and time() < hard_time_limit:
+            counter += 1
+            stencils = self.stencils[toggler]
+            source = buffers[toggler]
+            dest = buffers[1 - toggler]
+            check = counter % CHECK_INTERVAL == 0 or counter == max_steps
+            for h in active[:]:
+                for out, operand1, operand2 in stencils[h]:
+                    add(operand1, operand2, out=out)
+                multiply(dest[h], conductance[h], out=dest[h])
+                add(dest[h], emitters[h], out=dest[h])
+                hormone_passes[h] = counter
+                if check:
+                    residuals[h] = self._get_residual(source[h], dest[h])
+                    if residuals[h] <= tolerance:
+                        # freeze the plane in both buffers, so that it is
+                        # right whichever buffer ends up holding the field
+                        source[h][...] = dest[h]
+                        active.remove(h)
+            toggler = 1 - toggler
+        elapsed = (time() - start) * 1000
+        self.toggler = toggler
+        self.field = buffers[toggler]
+        self.warm = True
+        self.passes = counter
+        self.converged = not active
+        self.rate = counter / elapsed if elapsed > 0 else 0.0
+        return counter
+
+    def _get_residual(self, source, dest):
+        '''
+        Return the largest relative change between two planes.
+        '''
+        change, reference = self.scratch
+        subtract(dest, source, out=change)
+        absolute(change, out=change)
+        add(dest, TINY, out=reference)
+        divide(change, reference, out=change)
+        return change.max()
+
+
+class TimeIsUp(Exception):
+
+    '''
+    Raised from within the iterative solver to abort it.
+    '''
+
+
+class SparseDiffuser(object):
+
+    '''
+    Direct steady-state solver. For each hormone it solves the linear
+    system ``(I - ¼·P·A·P)·x = P·e``, where A is the adjacency matrix of the
+    torus, P the diagonal matrix of the passable tiles and e the emitters.
+    Opaque tiles have an identity row, hence their scent is 0.
+
+    The blocker set of a hormone changes every turn (own ants are opaque), so
+    the system is solved with plain conjugate gradients, started from the
+    previous solution when warm. CG needs a few dozen iterations where Jacobi
+    needs hundreds of passes, so a cold field converges about three times
+    faster (200x200: 50 ms vs 175 ms). Warm, Jacobi's change-based stop is
+    cheaper (a handful of passes): SPARSE pays when a converged field is
+    needed from scratch, e.g. on the first turn or after much new water.
+
+    Same interface as ``Diffuser``: ``passes`` counts the CG iterations (0
+    for a direct solve) and ``residuals`` are relative to the emitters' norm.
+    '''
+
+    def __init__(self, cols, rows, hormones=3):
+        shape = (hormones, cols, rows)
+        size = cols * rows
+        # Sparsity structure of I + A, one row per tile: itself, then the four
+        # neighbours. Only the values change from turn to turn.
+        self.indices = get_neighbour_table((cols, rows),
+            ((0, 0), (1, 0), (-1, 0), (0, 1), (0, -1))).ravel()
+        self.indptr = arange(0, 5 * size + 1, 5)
+        self.row_of = arange(size).repeat(5)
+        self.is_diagonal = (arange(5 * size) % 5) == 0
+        self.size = size
+        self.emitters = zeros(shape)
+        self.opaque = zeros(shape, dtype=bool)
+        self.field = zeros(shape)
+        self.warm = False
+        self.passes = 0
+        self.hormone_passes = [0] * hormones
+        self.residuals = [0.0] * hormones
+        self.converged = False
+        self.rate = 0.0
+
+    def prepare(self, emitters, opaque):
+        '''
+        Load the emitters and the blockers for the current turn.
+        - emitters : HORMONES x COLS x ROWS array of emitted scent (>= 0)
+        - opaque   : HORMONES x COLS x ROWS boolean array, True where the
+                     scent must be removed
+        '''
+        self.opaque[...] = opaque
+        multiply(emitters, logical_not(opaque), out=self.emitters)
+
+    def run(self, hard_time_limit, max_steps, warm=False, tolerance=0):
+        '''
+        Solve the steady state of each hormone. Iterative solutions stop at
+        ``hard_time_limit``, after ``max_steps`` iterations or once their
+        relative residual is within ``tolerance`` (or 1e-5, whichever is
+        larger). Return the number of iterations of the slowest hormone.
+        '''
+        start = time()
+        converged = True
+        for h in range(len(self.emitters)):
+            x, passes, residual = self._solve(h, hard_time_limit, max_steps,
+                                              warm and self.warm, tolerance)
+            self.field[h] = x.reshape(self.field[h].shape)
+            self.hormone_passes[h] = passes
+            self.residuals[h] = residual
+            converged = converged and residual <= max(tolerance, 1e-5)
+        elapsed = (time() - start) * 1000
+        self.warm = True
+        self.passes = max(self.hormone_passes)
+        self.converged = converged
+        self.rate = self.passes / elapsed if elapsed > 0 else 0.0
+        return self.passes
+
+    def _get_system(self, passable):
+        '''
+        Return the sparse matrix of the system for a given flat passable mask.
+        '''
+        data = -0.25 * passable[self.row_of] * passable[self.indices]
+        data[self.is_diagonal] = 1 + REGULARISATION
+        return csr_matrix((data, self.indices, self.indptr),
+                          shape=(self.size, self.size))
+
+    def _solve(self, h, hard_time_limit, max_steps, warm, tolerance):
+        '''
+        Solve the system of hormone ``h``. Return the solution, the number of
+        iterations and the relative residual.
+        '''
+        opaque = self.opaque[h].ravel()
+        b = self.emitters[h].ravel()
+        b_norm = norm(b)
+        if b_norm == 0:
+            return zeros(self.size), 0, 0.0
+        system = self._get_system(logical_not(opaque).astype(float))
+        # Iterative solution, with an anytime exit when the clock runs out
+        state = {'x': self.field[h].ravel() if warm else zeros(self.size),
+                 'passes': 0}
+        def callback(xk):
+            state['x'] = xk
+            state['passes'] += 1
+            if time() >= hard_time_limit:
+                raise TimeIsUp()
+        try:
+            x, info = cg(system, b, x0=state['x'].copy(), maxiter=max_steps,
+                         atol=tolerance * b_norm, callback=callback)
+        except TimeIsUp:
+            x = state['x']
+        return x, state['passes'], norm(b - system.dot(x)) / b_norm
+
+
+class DistanceDiffuser(object):
+
+    '''
+    Geodesic scent propagation. Emitter strengths are turned into a head start
+    (``-log4(e)`` tiles), so that a single multi-source BFS per hormone finds,
+    for every tile, the emitter whose scent is strongest there, wrapping on
+    the torus and going around opaque tiles. Cost is linear in the number of
+    tiles and the field reaches the whole map every turn.
+
+    Same interface as ``Diffuser``: ``passes`` counts the BFS levels, the
+    result is always exact (``converged`` is True, residuals are 0).
+    '''
+
+    def __init__(self, cols, rows, hormones=3):
+        shape = (hormones, cols, rows)
+        self.neighbours = get_neighbour_table((cols, rows),
+                                              ((1, 0), (-1, 0), (0, 1), (0, -1)))
+        self.emitters = zeros(shape)
+        self.passable = zeros(shape, dtype=bool)
+        self.field = zeros(shape)
+        self.passes = 0
+        self.hormone_passes = [0] * hormones
+        self.residuals = [0.0] * hormones
+        self.converged = True
+        self.rate = 0.0
+
+    def prepare(self, emitters, opaque):
+        '''
+        Load the emitters and the blockers for the current turn.
+        - emitters : HORMONES x COLS x ROWS array of emitted scent (>= 0)
+        - opaque   : HORMONES x COLS x ROWS boolean array, True where the
+                     scent must be removed
+        '''
+        logical_not(opaque, out=self.passable)
+        multiply(emitters, self.passable, out=self.emitters)
+
+    def run(self, hard_time_limit=None, max_steps=None, warm=False,
+            tolerance=0):
+        '''
+        Propagate all hormones. The arguments are accepted for compatibility
+        with the other engines, but the BFS always runs to completion.
+        Return the number of BFS levels of the farthest reaching hormone.
+        '''
+        start = time()
+        for h in range(len(self.emitters)):
+            emitters = self.emitters[h].ravel()
+            sources = flatnonzero(emitters)
+            if not len(sources):
+                self.field[h] = 0
+                self.hormone_passes[h] = 0
+                continue
+            # in log4 space a scent `e` is a head start of log4(e) tiles
+            head_start = log(emitters[sources]) / log(4)
+            strongest = head_start.max()
+            distance, origin = multi_source_bfs(sources,
+                self.passable[h].ravel(), self.neighbours,
+                strongest - head_start)
+            self.field[h] = power(0.25, distance - strongest).reshape(
+                                                        self.field[h].shape)
+            self.hormone_passes[h] = int(distance[origin >= 0].max())
+        elapsed = (time() - start) * 1000
+        self.passes = max(self.hormone_passes)
+        self.rate = self.passes / elapsed if elapsed > 0 else 0.0
+        return self.passes
+
+
+BACKENDS = {JACOBI: Diffuser, BFS: DistanceDiffuser}
+if HAS_SCIPY:
+    BACKENDS[SPARSE] = SparseDiffuser
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+
+'''
+Contest entry for the Fall 2011 challenge on http://aichallenge.org
+
+This file contains the container used for the world map: a stack of layers in
+which each layer is stored as its own contiguous COLS x ROWS numpy array (a
+"plane") with its own dtype, rather than as a strided slice of one big
+interleaved array.
+'''
+
+from numpy import zeros, stack, asarray
+
+__author__ = "Mac Ryan"
+__copyright__ = "Copyright 2011, Mac Ryan"
+__license__ = "GPL v3"
+#__version__ = "<dev>"
+#__date__ = "<unknown>"
+__maintainer__ = "Mac Ryan"
+__email__ = "quasipedia@gmail.com"
+__status__ = "Development"
+
+
+class LayeredMap(object):
+
+    '''
+    A COLS x ROWS x LAYERS map, stored as one plane per layer. Indexing mimics
+    the one of a 3 dimensional numpy array:
+    - ``map[..., LAYER]``, ``map[:, :, LAYER]`` : the plane itself (a view)
+    - ``map[x, y, LAYER]``, ``map[xs, ys, LAYER]`` : values in that plane
+    - ``map[loc]``, ``map[idx]`` : values of all layers at the location(s), as
+      an array whose last axis are the layers (a copy: good for reads like
+      ``map[loc][LAYER]``, writes must use ``map[x, y, LAYER] = value``)
+    - ``map[..., A:B]`` : same as above, for a range of layers
+    Code in hot paths should prefer working directly on ``planes``.
+    '''
+
+    def __init__(self, shape, dtypes):
+        self.planes = [zeros(shape, dtype=dtype) for dtype in dtypes]
+        self.shape = tuple(shape) + (len(dtypes), )
+
+    def __getitem__(self, key):
+        spatial, layers = self._split_key(key)
+        if isinstance(layers, slice):
+            return stack([plane[spatial] for plane in self.planes[layers]],
+                         axis=-1)
+        return self.planes[layers][spatial]
+
+    def __setitem__(self, key, value):
+        spatial, layers = self._split_key(key)
+        if isinstance(layers, slice):
+            planes = self.planes[layers]
+            value = asarray(value)
+            if value.ndim and value.shape[-1] == len(planes):
+                for i, plane in enumerate(planes):
+                    plane[spatial] = value[..., i]
+            else:
+                for plane in planes:
+                    plane[spatial] = value
+        else:
+            self.planes[layers][spatial] = value
+
+    def _split_key(self, key):
+        '''
+        Split an index into its spatial part and its layer part.
+        '''
+        if isinstance(key, list):  # fancy indexing like map[[xs, ys]]
+            key = tuple(key)
+        if isinstance(key, tuple):
+            if len(key) == 3:
+                return key[:2], key[2]
+            if len(key) == 2 and key[0] is Ellipsis:
+                return Ellipsis, key[1]
+        return key, slice(None)
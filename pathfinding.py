@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+
+'''
+Contest entry for the Fall 2011 challenge on http://aichallenge.org
+
+This file contains the A* pathfinder, used to lead a given ant to a given
+tile. Searches work on flat tile indices (col * ROWS + row) and on the
+neighbour table of the world, so they wrap around the torus. Paths go through
+the tiles not known to be water, and are kept across turns until newly seen
+water crosses them.
+'''
+
+from heapq import heappush, heappop
+
+from numpy import zeros, int32, column_stack, array
+
+__author__ = "Mac Ryan"
+__copyright__ = "Copyright 2011, Mac Ryan"
+__license__ = "GPL v3"
+#__version__ = "<dev>"
+#__date__ = "<unknown>"
+__maintainer__ = "Mac Ryan"
+__email__ = "quasipedia@gmail.com"
+__status__ = "Development"
+
+
+# Max number of paths (not counting their suffixes) kept in the cache: the
+# oldest ones are dropped first.
+PATH_CACHE = 1024
+
+
+class Pathfinder(object):
+
+    '''
+    A* searches over the map of `world`, avoiding the tiles marked in the
+    COLS x ROWS boolean plane `water`, with `World.manhattan` as the
+    heuristic. The open list is a binary heap (a plain list managed with
+    heapq), the closed set and the costs are arrays over the flat indices of
+    the tiles. Rather than clearing those arrays at each search, tiles are
+    "stamped" with the number of the search that visited them last.
+        Paths are cached by (source, target): a path is also registered under
+    all its suffixes, so an ant following it finds the rest of its path at
+    the next turn without searching again. At most `cache_size` paths are
+    kept.
+    '''
+
+    def __init__(self, world, water, cache_size=PATH_CACHE):
+        self.world = world
+        self.water = water.ravel()  # a view, updated with the map
+        size = world.cols * world.rows
+        self.cost = zeros(size, dtype=int32)
+        self.parent = zeros(size, dtype=int32)
+        self.reached = zeros(size, dtype=int32)  # stamp: cost is set
+        self.closed = zeros(size, dtype=int32)   # stamp: tile expanded
+        self.stamp = 0
+        self.paths = {}      # (source, target) -> (route id, position)
+        self.routes = {}     # route id -> list of tiles, source first
+        self.crossings = {}  # tile -> set of ids of the routes crossing it
+        self.last_route = 0
+        self.cache_size = cache_size
+
+    def get_path(self, source, target, max_nodes=None):
+        '''
+        Return the list of the flat indices of the tiles leading from
+        `source` to `target` (`source` excluded, `target` included), or None
+        if there is no such path (or if it couldn't be found expanding at
+        most `max_nodes` tiles).
+        '''
+        try:
+            route, position = self.paths[source, target]
+            return self.routes[route][position + 1:]
+        except KeyError:
+            pass
+        route = self.search(source, target, max_nodes)
+        if route is None:
+            return None
+        self._store(route)
+        return route[1:]
+
+    def search(self, source, target, max_nodes=None):
+        '''
+        Run A* from `source` to `target` (flat indices), and return the list
+        of the tiles of the path, both ends included, or None.
+        '''
+        world = self.world
+        water = self.water
+        if water[target]:
+            return None
+        neighbours = world.neighbours[:, 1:]
+        rows = world.rows
+        goal = array(divmod(target, rows))
+        cost, parent, reached, closed = self.cost, self.parent, \
+                                        self.reached, self.closed
+        self.stamp += 1
+        stamp = self.stamp
+        reached[source] = stamp
+        cost[source] = 0
+        heap = [(world.manhattan(array(divmod(source, rows)), goal), 0,
+                 source)]
+        expanded = 0
+        while heap:
+            estimate, tile_cost, tile = heappop(heap)
+            if closed[tile] == stamp:
+                continue  # a stale entry, the tile was reached cheaper
+            if tile == target:
+                return self._get_route(source, target)
+            closed[tile] = stamp
+            expanded += 1
+            if max_nodes is not None and expanded > max_nodes:
+                return None
+            tile_cost += 1
+            options = neighbours[tile]
+            options = options[~water[options] & (closed[options] != stamp) &
+                              ((reached[options] != stamp) |
+                               (cost[options] > tile_cost))]
+            if not len(options):
+                continue
+            reached[options] = stamp
+            cost[options] = tile_cost
+            parent[options] = tile
+            estimates = world.manhattan(column_stack(divmod(options, rows)),
+                                        goal) + tile_cost
+            # among equal estimates, the deepest tiles are expanded first
+            for option, estimate in zip(options.tolist(),
+                                        estimates.tolist()):
+                heappush(heap, (estimate, -tile_cost, option))
+        return None
+
+    def invalidate(self, tiles):
+        '''
+        Drop from the cache all the paths crossing any of `tiles` (flat
+        indices, e.g. of newly seen water).
+        '''
+        for tile in tiles:
+            for route in self.crossings.pop(tile, ()):
+                self._drop(route)
+
+    def _get_route(self, source, target):
+        '''
+        Return the path from `source` to `target` found by the last search.
+        '''
+        parent = self.parent
+        route = [target]
+        while route[-1] != source:
+            route.append(int(parent[route[-1]]))
+        route.reverse()
+        return route
+
+    def _store(self, route):
+        '''
+        Cache `route`, under all its suffixes, dropping the oldest routes
+        (the lowest ids) if the cache is full.
+        '''
+        while len(self.routes) >= self.cache_size:
+            self._drop(min(self.routes))
+        self.last_route += 1
+        id = self.last_route
+        self.routes[id] = route
+        target = route[-1]
+        for position, tile in enumerate(route):
+            key = tile, target
+            if key in self.paths:
+                self._drop(self.paths[key][0])
+            self.paths[key] = id, position
+            self.crossings.setdefault(tile, set()).add(id)
+
+    def _drop(self, id):
+        '''
+        Remove the route `id` from the cache.
+        '''
+        route = self.routes.pop(id, None)
+        if route is None:
+            return
+        target = route[-1]
+        for tile in route:
+            key = tile, target
+            if key in self.paths and self.paths[key][0] == id:
+                del self.paths[key]
+            crossing = self.crossings.get(tile)
+            if crossing is not None:
+                crossing.discard(id)
+                if not crossing:
+                    del self.crossings[tile]
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+
+'''
+Contest entry for the Fall 2011 challenge on http://aichallenge.org
+
+This file contains a spatial index for the entities scattered over the map
+(ants, food...). The map is divided in a coarse grid of buckets wrapping
+around the torus, and each entity is stored in the bucket containing it, so
+that a range query only looks at the entities in a handful of buckets rather
+than at all the tiles under a mask.
+'''
+
+from math import ceil
+
+from numpy import array, asarray, zeros, arange, argsort, bincount, cumsum, \
+                  concatenate, minimum
+
+__author__ = "Mac Ryan"
+__copyright__ = "Copyright 2011, Mac Ryan"
+__license__ = "GPL v3"
+#__version__ = "<dev>"
+#__date__ = "<unknown>"
+__maintainer__ = "Mac Ryan"
+__email__ = "quasipedia@gmail.com"
+__status__ = "Development"
+
+
+class GridIndex(object):
+
+    '''
+    A bucket grid over a COLS x ROWS torus. Buckets are at least
+    `bucket_size` tiles wide on each axis (the last ones absorb the remainder
+    of the division), so a query of radius R only needs to look at the
+    buckets at most ceil(R / bucket_size) buckets away from its own.
+        For each distance in buckets (the "reach") used by the queries, the
+    index keeps the list of entities in the neighbourhood of each bucket,
+    stored as compressed sparse rows: the candidates of a query are then a
+    single slice, ``positions[starts[b]:starts[b + 1]]``. Neighbourhoods are
+    computed on first use after each `build`.
+    '''
+
+    def __init__(self, world_size, bucket_size):
+        self.world_size = array(world_size)
+        cols, rows = world_size
+        self.bucket_size = max(1, bucket_size)
+        self.buckets = (max(1, cols // self.bucket_size),
+                        max(1, rows // self.bucket_size))
+        # bucket of each col and row, and the smallest bucket width
+        self.bucket_of = [arange(size) * buckets // size for size, buckets in
+                          zip(world_size, self.buckets)]
+        self.width = min([size // buckets for size, buckets in
+                          zip(world_size, self.buckets)])
+        self.build(())
+
+    def build(self, locs):
+        '''
+        (Re)build the index for the N x 2 array of locations `locs`.
+        '''
+        self.locs = asarray(locs, dtype=int).reshape(-1, 2)
+        self.bucket_cols = self.bucket_of[0][self.locs[:, 0]]
+        self.bucket_rows = self.bucket_of[1][self.locs[:, 1]]
+        self.neighbourhoods = {}
+        return self
+
+    def within(self, loc, radius2):
+        '''
+        Return the indices (in the array given to `build`) and the locations
+        of the entities within `radius2` (squared distance, wrapped) from
+        `loc`.
+        '''
+        reach = int(ceil(radius2 ** 0.5 / self.width))
+        candidates = self._get_candidates(loc, reach)
+        distances = self._get_distances2(loc, self.locs[candidates])
+        candidates = candidates[distances <= radius2]
+        return candidates, self.locs[candidates]
+
+    def nearest(self, loc, k=1):
+        '''
+        Return the indices (in the array given to `build`), the locations and
+        the squared distances of the `k` entities closest to `loc`, sorted by
+        distance. Rings of buckets are searched outwards until no entity in
+        the next ring can be closer than the k-th found so far.
+        '''
+        k = max(1, min(k, len(self.locs)))
+        max_reach = max(self.buckets) // 2  # the whole torus
+        reach = 0
+        while True:
+            candidates = self._get_candidates(loc, reach)
+            if len(candidates) >= k or reach >= max_reach:
+                distances = self._get_distances2(loc, self.locs[candidates])
+                order = argsort(distances, kind='mergesort')[:k]
+                # an entity outside the searched rings is more than
+                # `reach * width` tiles away on one of the axes
+                if reach >= max_reach or \
+                   distances[order[-1]] <= (reach * self.width) ** 2:
+                    candidates = candidates[order]
+                    return candidates, self.locs[candidates], \
+                           distances[order]
+            reach += 1
+
+    def _get_candidates(self, loc, reach):
+        '''
+        Return the indices of the entities stored in the buckets at most
+        `reach` buckets away from the one of `loc`.
+        '''
+        if reach not in self.neighbourhoods:
+            self.neighbourhoods[reach] = self._get_neighbourhood(reach)
+        starts, positions = self.neighbourhoods[reach]
+        bucket = self.bucket_of[0][loc[0]] * self.buckets[1] + \
+                 self.bucket_of[1][loc[1]]
+        return positions[starts[bucket]:starts[bucket + 1]]
+
+    def _get_neighbourhood(self, reach):
+        '''
+        Return the CSR arrays (starts, positions) listing, for each bucket,
+        the entities at most `reach` buckets away from it. Each entity is
+        listed under all the buckets around its own, then the list is sorted
+        by bucket.
+        '''
+        b_cols, b_rows = self.buckets
+        shifts = [arange(-reach, reach + 1) if 2 * reach + 1 < size else
+                  arange(size) for size in self.buckets]  # no repetitions
+        buckets = concatenate([
+            ((self.bucket_cols + d_col) % b_cols) * b_rows +
+            (self.bucket_rows + d_row) % b_rows
+            for d_col in shifts[0] for d_row in shifts[1]])
+        positions = arange(len(buckets)) % max(1, len(self.locs))
+        order = argsort(buckets, kind='mergesort')
+        starts = zeros(b_cols * b_rows + 1, dtype=int)
+        cumsum(bincount(buckets, minlength=b_cols * b_rows),
+               out=starts[1:])
+        return starts, positions[order]
+
+    def _get_distances2(self, loc, locs):
+        '''
+        Return the squared wrapped distances between `loc` and `locs`.
+        '''
+        deltas = abs(locs - loc)
+        deltas = minimum(deltas, self.world_size - deltas)
+        return (deltas ** 2).sum(axis=1)
@@ -10,7 +10,7 @@ part of the uploaded package. It is a devel's tool.
 Some information on the format of the log file:
 - Each line of data that is supposed to be parsed has the format:
   "DATA_ID : data0 label0, data1 label1, ... for example:
-  DIFFUSE : 204 passes, 204 needed
+  DIFFUSE : 204 passes, 204 needed, 0 saved, 1.20e-02 residual, 3.52 passes/ms
   TURN DURATION : 315 ms
 - Data that is for direct log inspection by a human is prefixed with at least
   one hash [#] sign.
@@ -30,6 +30,16 @@ __email__ = "quasipedia@gmail.com"
 __status__ = "Development"
 
 
+def to_number(string):
+    '''
+    Convert a logged value to int, or to float if it is not an integer.
+    '''
+    try:
+        return int(string)
+    except ValueError:
+        return float(string)
+
+
 class Viewer(object):
 
     '''
@@ -45,7 +55,7 @@ class Viewer(object):
                 continue
             dataid, data = [bit.strip() for bit in line.split(':')]
             data = [bit.strip() for bit in data.split(',')]
-            data = [int(string.split()[0]) for string in data]
+            data = [to_number(string.split()[0]) for string in data]
             if len(data) == 1:
                 data = data[0]
             try:
@@ -70,9 +80,20 @@ class Viewer(object):
         Provide stats about the diffusion process.
         '''
         data = self.data['DIFFUSE']
-        abs_max = max([le for le, need in data])
-        data = [le for le, need in data if le < need]
+        abs_max = max([passes for passes, need, saved, res, rate in data])
+        rates = [rate for passes, need, saved, res, rate in data]
+        savings = [saved for passes, need, saved, res, rate in data]
+        residuals = [res for passes, need, saved, res, rate in data]
+        # diffusion cut short by the clock (not by convergence)
+        data = [passes for passes, need, saved, res, rate in data
+                if passes < need and not saved]
         print('\n\n##### DIFFUSION #####')
+        print('Passes per ms (min/avg/max)    : %.2f  /  %.2f  /  %.2f' %
+            (min(rates), sum(rates) / len(rates), max(rates)))
+        print('Passes saved (min/avg/max)     : %.d  /  %.d  /  %.d' %
+            (min(savings), float(sum(savings)) / len(savings), max(savings)))
+        print('Residual (min/max)             : %.2e  /  %.2e' %
+            (min(residuals), max(residuals)))
         if data:
             print('Diffusion steps (min/avg/max)  : %.d  /  %.d  /  %.d\n' %
                 (min(data), float(sum(data)) / len(data), max(data)))
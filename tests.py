@@ -7,6 +7,7 @@ Contest entry for the Fall 2011 challenge on http://aichallenge.org
 This file contains the unit tests to verify the bot sanity.
 '''
 
+import os
 import unittest
 import sys
 import StringIO
@@ -15,6 +16,14 @@ import time
 import numpy as np
 
 import world
+from utils import dilate_count
+import diffusion
+import layeredmap
+import blockreader
+import spatial
+import combat
+import assignment
+import ai
 
 __author__ = "Mac Ryan"
 __copyright__ = "Copyright 2011, Mac Ryan"
@@ -155,6 +164,34 @@ class TestWorld(unittest.TestCase):
         found = np.where(self.world.map[:, :, world.ENEMY_DEAD])
         self.assertTrue((expected == found), msg='ENEMY DEAD')
 
+    def test_update_turn_and_owners(self):
+        TURN =  '''turn 7
+                    a 1 2 0
+                    a 3 4 2
+                    a 5 6  3
+                    d 7 8 2
+                '''
+        self._perform_world_setup()
+        data = [line.strip() for line in TURN.split('\n') if line.strip()]
+        self.world._update(data)
+        self.assertEqual(7, self.world.turn)
+        self.assertEqual(self.world.turns - 7, self.world.turns_left)
+        self.assertEqual({(2, 1): world.EXPLORER}, self.world.own_ants)
+        self.assertEqual({(4, 3): 2, (6, 5): 3}, self.world.enemy_ants)
+        self.assertEqual(3, self.world.map[6, 5, world.ENEMY_ANTS])
+        self.assertEqual(2, self.world.enemy_dead[(8, 7)][1])
+
+    def test_get_records(self):
+        records = self.world._get_records('''w 1 2\nw 3 4 5\na 6 7 1\n
+                                             f 8 9\n  a 10 11 0 \nh 12 13\n
+                                             d 14 15 2\ngo''')
+        # malformed records (a wrong number of fields) are skipped
+        self.assertEqual([[1], [2]], records['w'].tolist())
+        self.assertEqual([[8], [9]], records['f'].tolist())
+        self.assertEqual([[6, 10], [7, 11], [1, 0]], records['a'].tolist())
+        self.assertEqual([[14], [15], [2]], records['d'].tolist())
+        self.assertEqual((3, 0), records['h'].shape)
+
     def test_is_tile_visible(self):
         TURN =  'a 10 10 0\n'
         self._perform_world_setup()
@@ -163,6 +200,56 @@ class TestWorld(unittest.TestCase):
         self.assertTrue(self.world.is_tile_visible((11, 11)))
         self.assertFalse(self.world.is_tile_visible((1, 11)))
 
+    def test_update_view_counter(self):
+        self._perform_world_setup()  # map size: 30 cols x 20 rows
+        ants = [(0, 0), (29, 19), (15, 3), (16, 3), (7, 18)]
+        data = ['a %d %d 0' % (row, col) for col, row in ants]
+        self.world._update(data)
+        mask = self.world.view_mask
+        expected = np.zeros((30, 20), dtype=bool)
+        for col, row in ants:
+            expected[(col + mask[0]) % 30, (row + mask[1]) % 20] = True
+        self.assertTrue((expected == self.world.visible).all())
+        counter = self.world.map[..., world.UNSEEN_COUNTER]
+        self.assertTrue((counter[expected] == 0).all())
+        self.assertTrue((counter[~expected] ==
+                         world.UNSEEN_LAND_STEP).all())
+
+    def test_update_view_count(self):
+        self._perform_world_setup()  # map size: 30 cols x 20 rows
+        turns = [[(0, 0), (29, 19), (15, 3), (16, 3)],
+                 [(1, 0), (29, 0), (15, 3), (17, 3), (8, 8)],   # moves
+                 [(1, 0), (28, 0), (16, 3), (8, 7), (3, 3)],    # swap
+                 [(2, 0), (8, 7), (3, 4)]]                      # deaths
+        for ants in turns:
+            self.world._update(['a %d %d 0' % (row, col)
+                                for col, row in ants])
+            expected = dilate_count(self.world.map[..., world.OWN_ANTS],
+                                    self.world.view_runs)
+            self.assertTrue((expected == self.world.view_count).all())
+
+    def test_update_threat(self):
+        TURN =  '''a 10 10 1
+                    a 10 11 2
+                    a 0 0 1
+                    w 9 10
+                    f 0 1
+                    a 15 15 0
+                '''
+        self._perform_world_setup()  # map size: 30 cols x 20 rows
+        data = [line.strip() for line in TURN.split('\n') if line.strip()]
+        self.world._update(data)
+        w = self.world
+        expected = np.zeros((30, 20), dtype=int)
+        for enemy in w.enemy_ants:
+            reach = np.zeros((30, 20), dtype=bool)
+            for dest, direction in w.get_legal_moves(enemy):
+                for d_col, d_row in zip(*w.attack_mask):
+                    reach[(dest[0] + d_col) % 30, (dest[1] + d_row) % 20] = 1
+            expected += reach
+        self.assertTrue((expected == w.map[..., world.THREAT]).all())
+        self.assertEqual(2, w.map[10, 10, world.THREAT])
+
     def test_is_tile_passable(self):
         TURN =  ''''a 10 10 0
                     h 11 11 0
@@ -185,13 +272,37 @@ class TestWorld(unittest.TestCase):
         self.assertFalse(self.world.is_tile_passable((17, 11)), msg='food')
 
     def test_issue_order(self):
-        KNOWN = [((np.array((24, 12)), 'n'), 'o 12 24 n'),
-                 ((np.array((4, 2)), 'e'), 'o 2 4 e'),
-                 ((np.array((2, 1)), 's'), 'o 1 2 s'),
-                 ((np.array((33, 77)), 'w'), 'o 77 33 w')]
+        KNOWN = [((np.array((24, 12)), 'n'), 'o  12  24 n'),
+                 ((np.array((4, 2)), 'e'), 'o   2   4 e'),
+                 ((np.array((2, 1)), 's'), 'o   1   2 s'),
+                 ((np.array((33, 177)), 'w'), 'o 177  33 w'),
+                 ((np.array((0, 10)), 'w'), 'o  10   0 w')]
         for order, outcome in KNOWN:
             self.world.issue_order(order)
-            self.assertEqual(outcome, self._read_output()[0])
+        self.assertEqual([''], self._read_output())  # buffered
+        self.world.turn_start_time = 0
+        self.world.finish_turn()
+        self.assertEqual([outcome for order, outcome in KNOWN] + ['go'],
+                         self._read_output())
+
+    def test_issue_orders(self):
+        self.world.issue_order(((4, 2), 'e'))
+        # batch orders, growing the buffer and with a duplicate for (4, 2)
+        n = world.ORDER_BUFFER_SIZE
+        locs = np.array([(i, 0) for i in range(n)] + [(4, 2)])
+        self.world.issue_orders(locs, 's' * n + 'w')
+        self.assertEqual(n + 2, len(self.world.get_pending_orders()))
+        self.assertEqual([2, 4, ord('w')],
+                         list(self.world.get_pending_orders()[-1]))
+        self.world.dedupe_orders()
+        self.assertEqual(n + 1, len(self.world.get_pending_orders()))
+        self.world.turn_start_time = 0
+        self.world.finish_turn()
+        output = self._read_output()
+        output = [' '.join(line.split()) for line in output]
+        self.assertEqual(['o 2 4 e', 'o 0 0 s', 'o 0 1 s'], output[:3])
+        self.assertEqual(['o 0 %d s' % (n - 1), 'go'], output[-2:])
+        self.assertEqual(0, len(self.world.get_pending_orders()))
 
     def test_finish_turn(self):
         self.world.turn_start_time = 0
@@ -271,6 +382,92 @@ class TestWorld(unittest.TestCase):
         # to test the directions are right, not the abs value of the scent...
         self.assertEqual(EXPECTED, [el[1:] for el in result])
 
+    def test_all_ants_moves(self):
+        TURN =  '''f 9 6
+                    f 10 7
+                    a 8 5 1
+                    a 9 5 0
+                    a 11 9 0
+                    w 9 4
+                '''
+        self._perform_world_setup()
+        data = [line.strip() for line in TURN.split('\n') if line.strip()]
+        self.world._update(data)
+        self.world.diffuse()
+        locs = [(5, 9), (9, 11), (0, 0)]
+        dests, legal = self.world.get_legal_moves_all(locs)
+        for loc, loc_dests, loc_legal in zip(locs, dests, legal):
+            expected = set(tuple(move[0]) for move in
+                           self.world.get_legal_moves(loc))
+            found = set(divmod(dest, 20) for dest in loc_dests[loc_legal])
+            self.assertEqual(expected, found)
+        scents, dests = self.world.get_scent_strengths_all(locs,
+                                                           world.H_HARVEST)
+        for loc, loc_scents, loc_dests in zip(locs, scents, dests):
+            expected = self.world.get_scent_strengths(loc, world.H_HARVEST)
+            found = sorted([[scent, divmod(dest, 20), move] for
+                            scent, dest, move in
+                            zip(loc_scents, loc_dests, world.MOVES[1:])],
+                           reverse=True)
+            self.assertEqual(expected, found)
+
+    def test_get_scent_rankings(self):
+        TURN =  '''f 10 7
+                   a 11 9 0
+                '''
+        self._perform_world_setup()
+        data = [line.strip() for line in TURN.split('\n') if line.strip()]
+        self.world._update(data)
+        self.world.diffuse()
+        rankings, dests = self.world.get_scent_rankings([(9, 11)],
+                                                        world.H_HARVEST)
+        # same order as get_scent_strengths, staying last as its tile (an
+        # own ant) is opaque
+        self.assertEqual([4, 1, 3, 2, 0], rankings[0].tolist())
+        self.assertEqual([8 * 20 + 11, 9 * 20 + 10, 9 * 20 + 12,
+                          10 * 20 + 11, 9 * 20 + 11], dests[0].tolist())
+        # ties keep the MOVES order, with staying last (there's no fight)
+        rankings, dests = self.world.get_scent_rankings([(9, 10)],
+                                                        world.H_FIGHT)
+        self.assertEqual([1, 2, 3, 4, 0], rankings[0].tolist())
+
+    def test_get_distances(self):
+        # a wall of water between two food items, open at the top (rows wrap)
+        TURN = '\n'.join(['w %d 10' % row for row in range(1, 20)] +
+                          ['f 5 8', 'f 5 12'])
+        self._perform_world_setup()
+        self.world._update(TURN)
+        foods = self.world.get_flat_indices([(8, 5), (12, 5)])
+        distance, origin = self.world.get_distances(foods)
+        distance, origin = distance.reshape(30, 20), origin.reshape(30, 20)
+        self.assertEqual(0, distance[8, 5])
+        self.assertEqual((3, 0), (distance[9, 3], origin[9, 3]))
+        self.assertEqual((5, 1), (distance[11, 1], origin[11, 1]))
+        self.assertEqual(np.inf, distance[10, 5])  # water
+        # shorter wrapping around the map, through row 0
+        self.assertEqual((7, 1), (distance[11, 19], origin[11, 19]))
+        # farther tiles are unreachable when the search is bounded
+        distance, origin = self.world.get_distances(foods, 4)
+        self.assertEqual(4, distance[distance < np.inf].max())
+        self.assertEqual(-1, origin.reshape(30, 20)[11, 1])
+
+    def test_get_combat_outcomes(self):
+        self._perform_world_setup()  # map size: 30 cols x 20 rows
+        w = self.world
+        self.assertEqual(None, w.get_combat_outcomes((0, 0), (10, 0)))
+        for own, enemy in (((5, 5), (8, 6)), ((0, 0), (28, 19)),
+                           ((3, 3), (3, 3)), ((29, 10), (2, 8))):
+            outcomes = w.get_combat_outcomes(own, enemy)
+            for i, omove in enumerate(world.MOVES):
+                for j, emove in enumerate(world.MOVES):
+                    odest = w.destination(own, omove) if omove else own
+                    edest = w.destination(enemy, emove) if emove else enemy
+                    distance = sum(min(d, size - d) ** 2 for d, size in
+                                   zip(abs(np.array(odest) - edest),
+                                       (30, 20)))
+                    self.assertEqual(distance <= w.attackradius2,
+                                     outcomes[i, j])
+
     def test_get_stuff_in_sight(self):
         SETUP = '''turn 0
                    loadtime 3000
@@ -302,6 +499,50 @@ class TestWorld(unittest.TestCase):
             self.assertTrue(len(result) == 1)
             self.assertEqual(EXPECTED[layer], tuple(result[0]))
 
+    def test_batch_queries(self):
+        TURN =  '''a 11 9 0
+                    a 12 9 0
+                    a 1 28 0
+                    f 10 7
+                    a 13 10 1
+                    a 0 0 1
+                    a 19 29 1
+                '''
+        self._perform_world_setup()
+        data = [line.strip() for line in TURN.split('\n') if line.strip()]
+        self.world._update(data)
+        w = self.world
+        locs = np.array([(9, 11), (0, 0), (10, 13), (29, 19), (5, 5)])
+        for batch, single in (
+                (lambda l: w.get_stuff_in_sight_batch(l, world.FOOD),
+                 lambda l: w.get_stuff_in_sight(l, world.FOOD)),
+                (w.get_engageable_batch, w.get_engageable),
+                (w.get_in_attackradius_batch, w.get_in_attackradius)):
+            queries, hits = batch(locs)
+            self.assertEqual(len(queries), len(hits))
+            for i, loc in enumerate(locs):
+                self.assertEqual(single(loc).tolist(),
+                                 hits[queries == i].tolist())
+        # wrapping around the torus
+        queries, hits = w.get_in_attackradius_batch(locs[:2])
+        self.assertEqual([(1, [29, 19]), (1, [0, 0])], [(q, h) for q, h in
+                         zip(queries.tolist(), hits.tolist()) if q == 1])
+
+    def test_get_nearby_and_nearest(self):
+        TURN =  '''a 11 9 0
+                    f 10 7
+                    f 19 1
+                    f 0 28
+                '''
+        self._perform_world_setup()
+        data = [line.strip() for line in TURN.split('\n') if line.strip()]
+        self.world._update(data)
+        self.assertEqual([[7, 10]],
+                         self.world.get_nearby((9, 11), world.FOOD, 5).tolist())
+        locs, distances = self.world.get_nearest((29, 0), world.FOOD, 2)
+        self.assertEqual([[28, 0], [1, 19]], locs.tolist())
+        self.assertEqual([1, 5], distances.tolist())
+
     def test_get_in_attackradius(self):
         SETUP = '''turn 0
                    loadtime 3000
@@ -379,3 +620,551 @@ class TestWorld(unittest.TestCase):
         result = self.world.get_engageable((9, 11))
         result = set([tuple(arr) for arr in result])
         self.assertEqual(EXPECTED, result)
+
+
+    def test_get_scent_mask(self):
+        TURN =  '''w 1 1
+                    f 2 2
+                    a 3 3 0
+                    a 4 4 1
+                '''
+        self._perform_world_setup()
+        data = [line.strip() for line in TURN.split('\n') if line.strip()]
+        self.world._update(data)
+        emitters, opaque = self.world._get_scent_mask()
+        self.assertEqual((3, 30, 20), emitters.shape)
+        self.assertTrue(opaque[:, 1, 1].all())  # water
+        self.assertTrue(opaque[:, 3, 3].all())  # own ant
+        self.assertEqual([False, True, False], list(opaque[:, 4, 4]))
+        self.assertEqual([16, 16], list(emitters[::2, 4, 4]))
+        self.assertEqual([0, 64, 0], list(emitters[:, 2, 2]))
+        # unseen land emits scent to explore
+        self.assertEqual(0, emitters[0, 3, 4])
+        self.assertEqual(64, emitters[0, 20, 10])
+
+class TestDiffuser(unittest.TestCase):
+
+    '''
+    Tests the diffusion engine.
+    '''
+
+    def test_run(self):
+        # compare with the straightforward implementation using numpy.roll
+        rnd = np.random.RandomState(42)
+        emitters = rnd.rand(3, 7, 5) * (rnd.rand(3, 7, 5) > 0.8)
+        opaque = rnd.rand(3, 7, 5) > 0.7
+        expected = emitters * ~opaque
+        for i in range(10):
+            neighbours = sum([np.roll(expected, amount, axis=axis) for
+                              amount in (1, -1) for axis in (1, 2)])
+            expected = (neighbours * 0.25 + emitters) * ~opaque
+        diffuser = diffusion.Diffuser(7, 5)
+        diffuser.prepare(emitters, opaque)
+        self.assertEqual(10, diffuser.run(time.time() + 60, 10))
+        self.assertTrue(np.allclose(expected, diffuser.field))
+
+    def test_run_warm(self):
+        # a warm start must carry on from where the previous run stopped
+        rnd = np.random.RandomState(42)
+        emitters = rnd.rand(3, 7, 5) * (rnd.rand(3, 7, 5) > 0.8)
+        opaque = rnd.rand(3, 7, 5) > 0.7
+        cold = diffusion.Diffuser(7, 5)
+        cold.prepare(emitters, opaque)
+        cold.run(time.time() + 60, 15)
+        warm = diffusion.Diffuser(7, 5)
+        warm.prepare(emitters, opaque)
+        warm.run(time.time() + 60, 10)
+        warm.prepare(emitters, opaque)
+        warm.run(time.time() + 60, 5, warm=True)
+        self.assertTrue(np.allclose(cold.field, warm.field))
+        # ...and converge to the same field when emitters change
+        emitters = np.roll(emitters, 1, axis=1)
+        cold.prepare(emitters, opaque)
+        cold.run(time.time() + 60, 500)
+        warm.prepare(emitters, opaque)
+        warm.run(time.time() + 60, 500, warm=True)
+        self.assertTrue(np.allclose(cold.field, warm.field))
+
+    def test_run_convergence(self):
+        rnd = np.random.RandomState(42)
+        emitters = rnd.rand(3, 20, 20) * (rnd.rand(3, 20, 20) > 0.9)
+        emitters[2] = 0  # a hormone without emitters converges at once
+        opaque = rnd.rand(3, 20, 20) > 0.7
+        reference = diffusion.Diffuser(20, 20)
+        reference.prepare(emitters, opaque)
+        reference.run(time.time() + 60, 1000)
+        diffuser = diffusion.Diffuser(20, 20)
+        diffuser.prepare(emitters, opaque)
+        passes = diffuser.run(time.time() + 60, 1000, tolerance=1e-6)
+        self.assertTrue(diffuser.converged)
+        self.assertTrue(passes < 1000)
+        self.assertEqual(diffusion.CHECK_INTERVAL, diffuser.hormone_passes[2])
+        self.assertTrue(max(diffuser.residuals) <= 1e-6)
+        self.assertTrue(np.allclose(reference.field, diffuser.field))
+
+    def test_sparse(self):
+        if not diffusion.HAS_SCIPY:
+            return
+        rnd = np.random.RandomState(42)
+        emitters = rnd.rand(3, 20, 20) * (rnd.rand(3, 20, 20) > 0.9)
+        opaque = rnd.rand(3, 20, 20) > 0.7
+        reference = diffusion.Diffuser(20, 20)
+        reference.prepare(emitters, opaque)
+        reference.run(time.time() + 60, 1000, tolerance=1e-12)
+        sparse = diffusion.SparseDiffuser(20, 20)
+        sparse.prepare(emitters, opaque)
+        self.assertTrue(sparse.run(time.time() + 60, 1000))
+        self.assertTrue(sparse.converged)
+        self.assertTrue(np.allclose(reference.field, sparse.field, 1e-4, 1e-4))
+        # warm start from the previous solution: fewer iterations, same field
+        cold = sparse.passes
+        sparse.prepare(emitters, opaque)
+        sparse.run(time.time() + 60, 1000, warm=True)
+        self.assertTrue(sparse.converged)
+        self.assertTrue(sparse.passes < cold)
+        self.assertTrue(np.allclose(reference.field, sparse.field, 1e-4, 1e-4))
+
+    def test_bfs(self):
+        # compare with the fixed point of f = max(e, ¼ max(neighbours))
+        rnd = np.random.RandomState(42)
+        emitters = rnd.rand(3, 20, 20) * (rnd.rand(3, 20, 20) > 0.95) * 4 ** 3
+        opaque = rnd.rand(3, 20, 20) > 0.7
+        emitters[1] = 0
+        expected = emitters * ~opaque
+        for i in range(400):
+            neighbours = np.max([np.roll(expected, amount, axis=axis) for
+                                 amount in (1, -1) for axis in (1, 2)], 0)
+            expected = np.maximum(emitters, neighbours * 0.25) * ~opaque
+        diffuser = diffusion.DistanceDiffuser(20, 20)
+        diffuser.prepare(emitters, opaque)
+        diffuser.run()
+        self.assertTrue(np.allclose(expected, diffuser.field))
+
+
+class TestLayeredMap(unittest.TestCase):
+
+    '''
+    Tests the structure-of-arrays container of the world map.
+    '''
+
+    def test_indexing(self):
+        m = layeredmap.LayeredMap((4, 3), (bool, np.uint16, np.float32))
+        self.assertEqual((4, 3, 3), m.shape)
+        self.assertEqual(np.uint16, m[..., 1].dtype)
+        m[2, 1, 0] = True
+        m[..., 1] += 7
+        m[:, :, 2][3, 2] = 0.5
+        self.assertTrue(m.planes[0][2, 1])
+        self.assertEqual([1, 7, 0], list(m[2, 1]))
+        self.assertEqual(7, m[(2, 1)][1])
+        self.assertEqual(0.5, m[3, 2, 2])
+        self.assertEqual((2, 3), m[[np.array((0, 3)), np.array((2, 2))]].shape)
+        m[..., 1:] = 0
+        self.assertEqual(0, m.planes[1].sum() + m.planes[2].sum())
+        self.assertTrue(m[2, 1, 0])
+
+
+class TestBlockReader(unittest.TestCase):
+
+    '''
+    Tests the chunked reader of the engine input.
+    '''
+
+    def test_read_block(self):
+        fd_in, fd_out = os.pipe()
+        # tiny chunks, so that lines and terminators are split across reads
+        reader = blockreader.BlockReader(fd_in, chunk_size=3)
+        os.write(fd_out, 'turn 0\nRows 20\n\nREADY\nturn 1\nw 1 2\r\ngo\n')
+        os.close(fd_out)
+        self.assertEqual(('ready', 'turn 0\nrows 20\n\n'), reader.read_block())
+        self.assertEqual(('go', 'turn 1\nw 1 2\r\n'), reader.read_block())
+        self.assertRaises(EOFError, reader.read_block)
+        os.close(fd_in)
+
+    def test_world_update_from_block(self):
+        w = world.World()
+        w.setup('turn 0\nloadtime 3000\nturntime 1000\nrows 20\ncols 30\n'
+                'turns 500\nviewradius2 93\nattackradius2 6\n'
+                'spawnradius2 6\nplayer_seed 42\n')
+        w._update('turn 1\nw 1 2\r\nf 3 4\na 5 6 0\n')
+        self.assertEqual(1, w.turn)
+        self.assertTrue(w.map[2, 1, world.WATER])
+        self.assertEqual([(4, 3)], w.food.keys())
+        self.assertEqual({(6, 5): world.EXPLORER}, w.own_ants)
+
+
+class TestGridIndex(unittest.TestCase):
+
+    '''
+    Tests the bucket grid spatial index.
+    '''
+
+    def test_queries(self):
+        rnd = np.random.RandomState(42)
+        for size, bucket_size in (((30, 20), 5), ((30, 20), 3), ((9, 7), 8)):
+            locs = np.column_stack((rnd.randint(0, size[0], 40),
+                                    rnd.randint(0, size[1], 40)))
+            index = spatial.GridIndex(size, bucket_size).build(locs)
+            for i in range(50):
+                loc = rnd.randint(size[0]), rnd.randint(size[1])
+                deltas = abs(locs - loc)
+                deltas = np.minimum(deltas, np.array(size) - deltas)
+                expected = (deltas ** 2).sum(axis=1)
+                radius2 = rnd.randint(1, 100)
+                ids, found = index.within(loc, radius2)
+                self.assertEqual(sorted(np.nonzero(expected <= radius2)[0]),
+                                 sorted(ids))
+                self.assertTrue((locs[ids] == found).all())
+                ids, found, distances = index.nearest(loc, 4)
+                self.assertEqual(sorted(expected)[:4], distances.tolist())
+                self.assertEqual(expected[ids].tolist(), distances.tolist())
+
+
+class TestCombat(unittest.TestCase):
+
+    '''
+    Tests the battle logic.
+    '''
+
+    def test_find_components(self):
+        edges = np.array([(5, 1), (1, 3), (4, 6), (3, 0), (6, 4)])
+        self.assertEqual([0, 0, 2, 0, 4, 0, 4, 7],
+                         combat.find_components(8, edges).tolist())
+
+    def test_get_battle_groups(self):
+        w = world.World()
+        w.setup('''turn 0\nloadtime 3000\nturntime 1000\nrows 20\n
+                   cols 30\nturns 500\nviewradius2 77\nattackradius2 5\n
+                   spawnradius2 1\nplayer_seed 42''')
+        # a 2 vs 1 fight, a 1 vs 2 fight wrapping around the map, a loner
+        w._update('''a 5 5 0\na 9 5 0\na 7 8 1\n
+                     a 0 29 0\na 1 2 1\na 17 1 2\n
+                     a 15 15 0\n''')
+        groups = combat.get_battle_groups(w)
+        self.assertEqual([(2, 1), (1, 2)],
+                         sorted([(len(g.own), len(g.enemies)) for g in groups],
+                                reverse=True))
+        for group in groups:
+            for own, enemy in group.edges:
+                own = tuple(group.own[own])
+                enemy = tuple(group.enemies[enemy])
+                self.assertTrue(own in [tuple(loc) for loc in
+                                        w.get_engageable(enemy)])
+            self.assertEqual(len(group.own) * len(group.enemies),
+                             len(group.edges))
+
+    def test_resolve_battles(self):
+        # one configuration per row: 2 vs 1, 1 vs 1, collision of own ants
+        locs = [(10, 10), (10, 12), (12, 10)]
+        owners = [0, 0, 1]
+        moves = np.array([[0, 0, 3],   # stay, stay, s
+                          [1, 0, 1],   # n, stay, n
+                          [3, 1, 0]])  # s, n, stay
+        cols, rows = combat.apply_moves(locs, moves.T, (30, 20),
+                                        world.MOVE_OFFSETS)
+        dead = combat.resolve_battles(cols, rows, owners, 5)
+        self.assertEqual([[False, False, True],   # 2 vs 1: enemy dies
+                          [True, False, True],    # 1 vs 1: both die
+                          [True, True, False]],   # collision
+                         dead.T.tolist())
+        # compare with a straightforward implementation of the rules
+        rnd = np.random.RandomState(42)
+        locs = np.array([(0, 0), (1, 2), (2, 1), (3, 0), (29, 19), (2, 3)])
+        owners = np.array([0, 0, 1, 1, 2, 1])
+        moves = rnd.randint(0, 5, (6, 200))
+        cols, rows = combat.apply_moves(locs, moves, (30, 20),
+                                        world.MOVE_OFFSETS)
+        dead = combat.resolve_battles(cols, rows, owners, 5)
+        for config in range(200):
+            pos = zip(cols[:, config], rows[:, config])
+            alive = [pos.count(p) == 1 for p in pos]
+            in_range = [[j for j in range(6) if alive[i] and alive[j] and
+                         owners[i] != owners[j] and
+                         (pos[i][0] - pos[j][0]) ** 2 +
+                         (pos[i][1] - pos[j][1]) ** 2 <= 5]
+                        for i in range(6)]
+            expected = [not alive[i] or
+                        any([len(in_range[j]) <= len(in_range[i])
+                             for j in in_range[i]]) for i in range(6)]
+            self.assertEqual(expected, dead[:, config].tolist())
+
+    def test_search_battle(self):
+        w = world.World()
+        w.setup('''turn 0\nloadtime 3000\nturntime 1000\nrows 20\n
+                   cols 30\nturns 500\nviewradius2 77\nattackradius2 5\n
+                   spawnradius2 1\nplayer_seed 42''')
+        w._update('''a 10 10 0\na 10 12 0\na 13 11 1\n''')
+        group, = combat.get_battle_groups(w)
+        # no time: all the ants stay
+        moves, value = combat.search_battle(w, group, 10 ** 6)
+        self.assertEqual([0, 0], moves.tolist())
+        self.assertEqual(None, value)
+        # with time, the maximin over all the move sets is found
+        moves, value = combat.search_battle(w, group,
+                                            w.time_remaining() - 100,
+                                            random=np.random.RandomState(42))
+        locs = np.concatenate((group.own, group.enemies))
+        every = np.indices((5, 5)).reshape(2, -1)
+        payoff = combat._evaluate(w, locs, [0, 0, 1], every,
+                                  np.arange(5).reshape(1, -1))
+        self.assertAlmostEqual(payoff.min(axis=1).max(), value)
+        self.assertEqual(value, payoff[moves[0] * 5 + moves[1]].min())
+        # among the safe move sets, one closing in on the enemy is chosen
+        dests = w.neighbours[w.get_flat_indices(group.own), moves]
+        self.assertTrue(sum([w.manhattan(np.array(divmod(dest, 20)),
+                                         group.enemies[0])
+                             for dest in dests.tolist()]) < 8)
+        # reserved tiles are avoided
+        reserved = w.neighbours[w.get_flat_indices(group.own)].ravel()
+        moves, value = combat.search_battle(w, group,
+                                            w.time_remaining() - 20,
+                                            reserved=reserved)
+        self.assertEqual([0, 0], moves.tolist())
+
+    def test_search_battle_deadline(self):
+        w = world.World()
+        w.setup('''turn 0\nloadtime 3000\nturntime 1000\nrows 100\n
+                   cols 100\nturns 500\nviewradius2 77\nattackradius2 5\n
+                   spawnradius2 1\nplayer_seed 42''')
+        w._update(''.join('a %d %d %d\n' % (row, col, (row + col) // 3 % 2)
+                          for row in range(20, 80, 3)
+                          for col in range(20, 80, 3)))
+        group, = combat.get_battle_groups(w)
+        # rounds that can't end in the slice given are not started
+        rounds = self._count_rounds(w, group, w.time_remaining() - 5)
+        moves, value = combat.search_battle(w, group, w.time_remaining() - 5)
+        self.assertEqual(0, rounds)
+        self.assertEqual(None, value)
+        self.assertFalse(moves.any())
+
+    def test_search_battle_early_stop(self):
+        w = world.World()
+        w.setup('''turn 0\nloadtime 3000\nturntime 1000\nrows 20\n
+                   cols 30\nturns 500\nviewradius2 77\nattackradius2 5\n
+                   spawnradius2 1\nplayer_seed 42''')
+        # all the move sets of a 2 vs 1 fit in one exact round
+        w._update('''a 10 10 0\na 10 12 0\na 13 11 1\n''')
+        group, = combat.get_battle_groups(w)
+        stop_at = w.time_remaining() - 2000
+        self.assertEqual(1, self._count_rounds(w, group, stop_at))
+        # a 3 vs 3 is sampled, until the best worst case stops improving
+        w._update('''a 10 10 0\na 10 12 0\na 10 14 0\n
+                     a 13 10 1\na 13 12 1\na 13 14 1\n''')
+        group, = combat.get_battle_groups(w)
+        rounds = self._count_rounds(w, group, stop_at)
+        self.assertTrue(combat.SEARCH_PATIENCE < rounds < 50)
+
+    def _count_rounds(self, w, group, stop_at):
+        '''
+        Helper function that returns the number of rounds evaluated by the
+        battle search of `group`.
+        '''
+        evaluate = combat._evaluate
+        rounds = []
+        def counting(*args):
+            rounds.append(None)
+            return evaluate(*args)
+        combat._evaluate = counting
+        try:
+            combat.search_battle(w, group, stop_at,
+                                 random=np.random.RandomState(42))
+        finally:
+            combat._evaluate = evaluate
+        return len(rounds)
+
+
+class TestAssignment(unittest.TestCase):
+
+    '''
+    Tests the move assignment solver.
+    '''
+
+    def test_assign(self):
+        # the greedy choice of ant 0 (tile 1) would leave ant 1 with tile 3
+        candidates = np.array([(1, 2), (1, 3), (2, 0)])
+        scores = np.array([(1.0, 0.9), (1.0, -np.inf), (0.5, 0.0)])
+        self.assertEqual([1, 0, 1],
+                         assignment.assign(candidates, scores).tolist())
+        # compare with an exhaustive search
+        rnd = np.random.RandomState(42)
+        for i in range(50):
+            candidates = rnd.randint(0, 8, (5, 3))
+            scores = rnd.rand(5, 3)
+            scores[:, 2] = 0.0  # each ant has its own tile to stay on
+            candidates[:, 2] = range(8, 13)
+            columns = assignment.assign(candidates, scores, epsilon=1e-4)
+            tiles = candidates[range(5), columns]
+            self.assertEqual(5, len(set(tiles)))
+            best = max([sum(scores[range(5), choice]) for choice in
+                        np.indices((3,) * 5).reshape(5, -1).T if
+                        len(set(candidates[range(5), choice])) == 5])
+            self.assertTrue(sum(scores[range(5), columns]) >=
+                            best - 5 * 1e-4)
+
+    def test_assign_out_of_time_with_stays(self):
+        # explore-shaped: ants on a line can stay, step back or forward
+        rnd = np.random.RandomState(0)
+        for i in range(200):
+            locs = np.sort(rnd.choice(30, rnd.randint(2, 12), replace=False))
+            candidates = np.column_stack((locs - 1, locs + 1, locs))
+            scores = rnd.rand(len(locs), 3)
+            scores[:, 2] = 0.0
+            columns = assignment.assign(candidates, scores, time_limit=0,
+                                        stays=[2] * len(locs))
+            self.assertTrue((columns >= 0).all())
+            tiles = candidates[range(len(locs)), columns]
+            self.assertEqual(len(locs), len(set(tiles)))
+
+    def test_assign_out_of_time(self):
+        candidates = np.array([(1, 2), (1, 3), (1, 4)])
+        scores = np.array([(1.0, 0.0), (2.0, 0.0), (1.0, -np.inf)])
+        columns = assignment.assign(candidates, scores, time_limit=0)
+        self.assertEqual([1, 0, -1], columns.tolist())
+
+
+class TestPathfinder(unittest.TestCase):
+
+    '''
+    Tests the A* pathfinder and its cache.
+    '''
+
+    def setUp(self):
+        self.world = world.World()
+        self.world.setup('''turn 0\nloadtime 3000\nturntime 1000\nrows 20\n
+                            cols 30\nturns 500\nviewradius2 77\n
+                            attackradius2 5\nspawnradius2 1\n
+                            player_seed 42''')
+
+    def test_manhattan(self):
+        w = self.world
+        locs = np.array([(0, 0), (29, 19), (15, 10)])
+        self.assertEqual([2, 0, 23], w.manhattan(locs, (29, 19)).tolist())
+        self.assertEqual(23, w.manhattan(locs[2], locs[1]))
+
+    def test_get_path(self):
+        w = self.world
+        # a wall at col 10, open only on row 0 (rows wrap)
+        w._update('\n'.join(['w %d 10' % row for row in range(1, 20)]))
+        path = w.get_path((8, 5), (12, 5))
+        distance = w.get_distances([8 * 20 + 5])[0][12 * 20 + 5]
+        self.assertEqual(distance, len(path))
+        self.assertEqual((12, 5), path[-1])
+        self.assertTrue((10, 0) in path)
+        for loc1, loc2 in zip([(8, 5)] + path, path):
+            self.assertEqual(1, w.manhattan(np.array(loc1), np.array(loc2)))
+        self.assertEqual(None, w.get_path((8, 5), (10, 5)))  # water
+
+    def test_cache(self):
+        w = self.world
+        finder = w.pathfinder
+        path = w.get_path((8, 5), (12, 5))
+        stamp = finder.stamp
+        # the rest of the path is found without searching
+        self.assertEqual(path[1:], w.get_path(path[0], (12, 5)))
+        self.assertEqual(stamp, finder.stamp)
+        # water away from the path leaves it in the cache...
+        w._update('w 15 25\n')
+        self.assertEqual(path, w.get_path((8, 5), (12, 5)))
+        self.assertEqual(stamp, finder.stamp)
+        # ...water on the path drops it, and the new one goes around
+        w._update('w %d %d\n' % path[1][::-1])
+        self.assertEqual(stamp, finder.stamp)
+        self.assertFalse(path[1] in w.get_path((8, 5), (12, 5)))
+        self.assertEqual(stamp + 1, finder.stamp)
+
+    def test_cache_size(self):
+        w = self.world
+        finder = w.pathfinder
+        finder.cache_size = 2
+        ends = [((2, 2), (2, 6)), ((12, 2), (12, 6)), ((22, 2), (22, 6))]
+        paths = [w.get_path(source, target) for source, target in ends]
+        self.assertEqual(2, len(finder.routes))
+        self.assertEqual(sum([len(route) for route in finder.routes.values()]),
+                         len(finder.paths))
+        stamp = finder.stamp
+        # the newest paths are still cached, the oldest one was dropped
+        self.assertEqual(paths[2], w.get_path(*ends[2]))
+        self.assertEqual(stamp, finder.stamp)
+        self.assertEqual(paths[0], w.get_path(*ends[0]))
+        self.assertEqual(stamp + 1, finder.stamp)
+        self.assertEqual(2, len(finder.routes))
+
+    def test_get_flow_field(self):
+        w = self.world
+        w._update('\n'.join(['w %d 10' % row for row in range(1, 20)]))
+        targets = [(12, 5), (12, 15)]
+        field = w.get_flow_field(targets)
+        self.assertTrue(field is w.get_flow_field(targets[::-1]))
+        self.assertEqual(0, field[12, 5])
+        self.assertEqual(0, field[10, 5])  # water
+        # following the field is a shortest path to the closest target
+        distance = w.get_distances(w.get_flat_indices(targets))[0]
+        loc, steps = (8, 5), 0
+        while field[loc]:
+            loc = tuple(w.destination(loc, world.MOVES[field[loc]]))
+            steps += 1
+        self.assertTrue(loc in targets)
+        self.assertEqual(distance[8 * 20 + 5], steps)
+        # new water drops the cached fields
+        w._update('w 0 10\n')
+        field = w.get_flow_field(targets)
+        self.assertEqual(4, field[8, 5])  # west, all around the map
+
+
+class TestBot(unittest.TestCase):
+
+    '''
+    Tests the turn phases of the Bot.
+    '''
+
+    def setUp(self):
+        self.world = world.World()
+        self.world.setup('''turn 0\nloadtime 3000\nturntime 1000\nrows 20\n
+                            cols 30\nturns 500\nviewradius2 10\n
+                            attackradius2 5\nspawnradius2 1\n
+                            player_seed 42''')
+        self.bot = ai.Bot(self.world)
+
+    def _start_turn(self, data):
+        '''
+        Helper function that loads a turn and resets the turn variables.
+        '''
+        self.world._update(data)
+        self.bot.ants_to_process = set(self.world.own_ants.keys())
+        self.bot.destinations = set()
+
+    def test_harvest(self):
+        self._start_turn('f 5 5\na 5 7 0\na 5 8 0\na 15 20 0\n')
+        self.world.diffuse()
+        bot = self.bot
+        bot.harvest()
+        # the closest ant in sight of the food heads to it, the others don't
+        self.assertEqual([[5, 7, ord('w')]],
+                         self.world.get_pending_orders().tolist())
+        self.assertEqual(set([(8, 5), (20, 15)]), bot.ants_to_process)
+        self.assertEqual(set([6 * 20 + 5]), bot.destinations)
+        # busy ants are left alone: the next closest goes instead
+        self.world.orders_count = 0
+        bot.ants_to_process = set([(8, 5), (20, 15)])
+        bot.destinations = set()
+        bot.harvest()
+        self.assertEqual([[5, 8]],
+                         self.world.get_pending_orders()[:, :2].tolist())
+        self.assertEqual(set([(20, 15)]), bot.ants_to_process)
+
+    def test_attack(self):
+        # a 2 vs 1 fight, and an ant far from it
+        self._start_turn('a 10 10 0\na 10 12 0\na 13 11 1\na 2 25 0\n')
+        bot = self.bot
+        bot.attack()
+        # the ants of the fight are taken care of, the other one is left alone
+        self.assertEqual(set([(25, 2)]), bot.ants_to_process)
+        self.assertEqual(2, len(bot.destinations))
+        # the orders are the ones of the moving ants, towards the destinations
+        w = self.world
+        orders = w.get_pending_orders().tolist()
+        self.assertTrue(orders)
+        for row, col, direction in orders:
+            self.assertTrue((row, col) in [(10, 10), (10, 12)])
+            dest = w.destination((col, row), chr(direction))
+            self.assertTrue(w.get_flat_indices([dest])[0] in bot.destinations)
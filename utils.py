@@ -8,7 +8,10 @@ This file contains general-iterest utilities, mostly linked to numpy.
 '''
 
 
-from numpy import array, empty_like, zeros, where, ndindex, roll, logical_xor
+from numpy import array, empty, empty_like, zeros, ones, where, ndindex, roll, \
+                  logical_xor, indices, column_stack, asarray, arange, \
+                  argsort, lexsort, searchsorted, floor, concatenate, inf, \
+                  unique, cumsum, int32
 from numpy import bool as np_bool
 
 
@@ -21,7 +24,9 @@ __maintainer__ = "Mac Ryan"
 __email__ = "quasipedia@gmail.com"
 __status__ = "Development"
 __all__ = ['fastroll', 'get_circular_mask', 'get_circular_mask_tmc',
-           'get_attack_plus_two']
+           'get_attack_plus_two', 'get_neighbour_table', 'multi_source_bfs',
+           'get_mask_runs', 'dilate_count', 'get_crescents',
+           'get_combat_table']
 
 
 def fastroll(array, dist, axis):
@@ -96,4 +101,168 @@ def get_attack_plus_two(radius2):
     tmp = where(disc)
     return tuple([value - radius for value in tmp])
 
+def get_neighbour_table(world_size, offsets):
+    '''
+    Return a (COLS * ROWS) x len(offsets) array whose row ``i`` lists the flat
+    indices of the tiles at ``offsets`` from tile ``i``, wrapping around the
+    torus. The flat index of (col, row) is ``col * ROWS + row``, i.e. the
+    index in a raveled COLS x ROWS array.
+    '''
+    cols, rows = world_size
+    col, row = indices((cols, rows)).reshape(2, -1)
+    return column_stack([((col + d_col) % cols) * rows + (row + d_row) % rows
+                         for d_col, d_row in offsets])
+
+def multi_source_bfs(sources, passable, neighbours, offsets=None,
+                     max_distance=None):
+    '''
+    Breadth-first search from many sources at once, over the graph described
+    by the ``neighbours`` table (see ``get_neighbour_table``), expanding the
+    whole frontier with a handful of array operations per level.
+    Return two flat arrays: the distance of each node from its closest source
+    (inf if unreachable) and the index in ``sources`` of that source (-1).
+        Sources can be given non-negative ``offsets`` (a handicap), in which
+    case the distance is the smallest ``offset + path length``. Sources are
+    then released level by level, so that nodes are still settled only once.
+        The search stops at ``max_distance``: farther nodes are reported as
+    unreachable.
+    '''
+    size = len(passable)
+    distance = empty(size)
+    distance.fill(inf)
+    origin = empty(size, dtype=int)
+    origin.fill(-1)
+    sources = asarray(sources, dtype=int)
+    ids = arange(len(sources))
+    if offsets is None:
+        offsets = zeros(len(sources))
+    offsets = asarray(offsets, dtype=float)
+    # sources sorted by handicap, so that each level releases a slice
+    order = argsort(offsets, kind='mergesort')
+    sources, ids, offsets = sources[order], ids[order], offsets[order]
+    levels = floor(offsets).astype(int)
+    exact = (offsets == levels).all()  # whole offsets: no sort needed
+    slot = empty(size, dtype=int)
+    width = neighbours.shape[1]
+    frontier = empty(0, dtype=int)
+    frontier_distance = empty(0)
+    frontier_origin = empty(0, dtype=int)
+    released = 0
+    level = 0
+    while released < len(sources) or len(frontier):
+        if not len(frontier):
+            level = levels[released]  # nothing to expand: skip empty levels
+        stop = searchsorted(levels, level, 'right')
+        candidates = concatenate((neighbours[frontier].ravel(),
+                                  sources[released:stop]))
+        candidates_distance = concatenate((
+            frontier_distance.repeat(width) + 1, offsets[released:stop]))
+        candidates_origin = concatenate((frontier_origin.repeat(width),
+                                         ids[released:stop]))
+        released = stop
+        keep = passable[candidates] & (distance[candidates] == inf)
+        candidates = candidates[keep]
+        candidates_distance = candidates_distance[keep]
+        candidates_origin = candidates_origin[keep]
+        if exact:
+            # all candidates are at the same distance: a node reached more
+            # than once keeps any of them (the last one written)
+            positions = arange(len(candidates))
+            slot[candidates] = positions
+            first = slot[candidates] == positions
+            frontier = candidates[first]
+            frontier_distance = candidates_distance[first]
+            frontier_origin = candidates_origin[first]
+        else:
+            # a node reached more than once keeps its shortest distance
+            order = lexsort((candidates_distance, candidates))
+            candidates = candidates[order]
+            first = ones(len(candidates), dtype=np_bool)
+            first[1:] = candidates[1:] != candidates[:-1]
+            frontier = candidates[first]
+            frontier_distance = candidates_distance[order][first]
+            frontier_origin = candidates_origin[order][first]
+        distance[frontier] = frontier_distance
+        origin[frontier] = frontier_origin
+        level += 1
+        if max_distance is not None and level > max_distance:
+            break
+    return distance, origin
+
+def get_mask_runs(mask):
+    '''
+    Decompose a mask of offsets (as returned by ``get_circular_mask``) in
+    runs of consecutive row offsets sharing the same column offset. Return a
+    list of (d_col, lo, hi) tuples, meaning offsets (d_col, lo..hi). A disc
+    has one run per column, a ring two for the columns crossing its hole.
+    '''
+    runs = []
+    d_cols, d_rows = mask
+    for d_col in unique(d_cols):
+        column = sorted(d_rows[d_cols == d_col])
+        lo = column[0]
+        for prev, d_row in zip(column, column[1:] + [None]):
+            if d_row != prev + 1:
+                runs.append((int(d_col), int(lo), int(prev)))
+                lo = d_row
+    return runs
 
+def dilate_count(plane, runs):
+    '''
+    Return, for each tile of the COLS x ROWS ``plane`` (wrapping around the
+    torus), the sum of the values of the tiles from which it can be reached
+    with one of the offsets in ``runs`` (see ``get_mask_runs``). With a
+    boolean plane of ants and their view mask, this is the number of ants
+    seeing each tile, and ``> 0`` gives the visible tiles.
+        Each run is a sliding window along the rows, computed for the whole
+    map as the difference of two slices of a cumulative sum; windows are then
+    shifted along the columns and summed.
+    '''
+    cols, rows = plane.shape
+    pad = max([max(abs(lo), abs(hi)) for d_col, lo, hi in runs])
+    extended = plane[:, arange(-pad, rows + pad) % rows]
+    sums = zeros((cols, rows + 2 * pad + 1), dtype=int32)
+    cumsum(extended, axis=1, out=sums[:, 1:])
+    windows = {}
+    counts = zeros((cols, rows), dtype=int32)
+    for d_col, lo, hi in runs:
+        if (lo, hi) not in windows:
+            # window[c, r] = sum of plane[c, r - hi .. r - lo]
+            start = pad - hi
+            stop = pad - lo + 1
+            windows[(lo, hi)] = sums[:, stop:stop + rows] - \
+                                sums[:, start:start + rows]
+        window = windows[(lo, hi)]
+        # counts[c] += window[c - d_col]
+        d_col %= cols
+        counts[d_col:] += window[:cols - d_col]
+        counts[:d_col] += window[cols - d_col:]
+    return counts
+
+def get_crescents(mask, d_col, d_row):
+    '''
+    Return the tiles gained and lost by a mask (as returned by
+    ``get_circular_mask``) when its centre moves by (d_col, d_row), as two
+    masks of offsets relative to the starting centre.
+    '''
+    before = set(zip(*[axis.tolist() for axis in mask]))
+    after = set([(col + d_col, row + d_row) for col, row in before])
+    gained = array(sorted(after - before), dtype=int).reshape(-1, 2).T
+    lost = array(sorted(before - after), dtype=int).reshape(-1, 2).T
+    return tuple(gained), tuple(lost)
+
+def get_combat_table(radius2, radius, moves):
+    '''
+    Return a (2R+1) x (2R+1) x M x M boolean table (R = ``radius``, M the
+    number of ``moves``), whose item [d_col + R, d_row + R, i, j] tells if two
+    ants at offset (d_col, d_row) from each other are within ``radius2`` after
+    the first one performs move ``i`` and the second one move ``j``.
+    '''
+    offsets = arange(-radius, radius + 1)
+    moves = array(moves)
+    # distance after the moves, per axis: offset + second move - first move
+    d_cols = offsets.reshape(-1, 1, 1, 1) + \
+             moves[:, 0].reshape(1, -1) - moves[:, 0].reshape(-1, 1)
+    d_rows = offsets.reshape(1, -1, 1, 1) + \
+             moves[:, 1].reshape(1, -1) - moves[:, 1].reshape(-1, 1)
+    return d_cols ** 2 + d_rows ** 2 <= radius2
@@ -14,9 +14,12 @@ This module/class exposes to the main bot:
 - Several utility functions to issue orders, perform proximity checks, diffuse
   the hormons, etc...
 
-The MAP is a 3 dimensional numpy array, in which the first two axis are the
+The MAP is a 3 dimensional structure, in which the first two axis are the
 X, Y coordinates of the world, and the third dimension contains a stack of
 layers, where 0 means "empty" and any other value means "something is here".
+Each layer is stored as a separate contiguous numpy array with the narrowest
+dtype that fits its content (see LAYER_DTYPES and layeredmap.py), but the map
+can be indexed like a 3D array: ``map[..., LAYER]``, ``map[x, y, LAYER]``...
 This structure was chosed to allow:
 - different entities to be stacked (food can spawn on a dead ant, for example)
 - nonzero tests
@@ -34,23 +37,32 @@ The layers in the map are:
 - exploration hormon value
 - food hormon value
 - fighting hormon value
+- threat (number of enemy ants that could attack the tile next turn)
 All layers can contain a value >=0, with 0 == no entity of that type there and
 the other values being used as multipliers for the scent.
     Given that contest organisers assert the max size of a map is be 200x200,
-and that the numpy array is float64, and has 12 layers, the overall size of the
-map can reach a maximum of 64/8/1024 * 12 * 200 * 200 = 3.75 Mbytes.
+and that the layers take 32 bytes per tile altogether, the overall size of the
+map can reach a maximum of 32/1024 * 200 * 200 = 1.22 Mbytes.
 '''
 
+import re
 import sys
 from time import time
+from array import array as py_array
 
-from numpy import array, zeros, ones, int8, minimum, where, roll, \
-                  logical_and, nonzero, isnan, logical_or
+from numpy import array, zeros, ones, int8, uint8, uint16, float32, \
+                  minimum, where, logical_and, nonzero, isnan, logical_or, \
+                  nan_to_num, fromstring, frombuffer, asarray, unique, empty, \
+                  bincount, concatenate, flatnonzero, column_stack, arange, inf
 from numpy import abs as np_abs
 from numpy import nan as np_nan
 from numpy import sum as np_sum
 
 from utils import *
+from diffusion import BACKENDS, JACOBI, SPARSE, BFS
+from layeredmap import LayeredMap
+from spatial import GridIndex
+from pathfinding import Pathfinder
 from checklocal import RUNS_LOCALLY
 if RUNS_LOCALLY:
     from overlay import overlay
@@ -78,6 +90,19 @@ FADING_UNSEEN_FOOD = 1.0 / 10
 # UNSEEN LAND
 UNSEEN_LAND_STEP = 4**2
 
+# DIFFUSION
+# When True, each turn the diffusion starts from the previous turn's field
+# (corrected for the emitters that changed) instead of from scratch, so that
+# a near-steady field is reached in a handful of passes.
+WARM_DIFFUSION = True
+# Each hormone stops diffusing once no tile changes by more than this fraction
+# of its value during a pass.
+DIFFUSION_TOLERANCE = 1e-3
+# Default diffusion engine: JACOBI (time-bounded iterations), SPARSE (steady
+# state solved as a linear system, falls back to JACOBI without scipy) or BFS
+# (exact geodesic propagation of the strongest emitter)
+DIFFUSION_BACKEND = JACOBI
+
 # SCENT MASK INDEXES
 MASK_H_EXPLORE = 0
 MASK_H_HARVEST = 1
@@ -96,6 +121,22 @@ UNSEEN_COUNTER = 8  # this MUST be just before the hormons!!!
 H_EXPLORE = 1 + UNSEEN_COUNTER + MASK_H_EXPLORE
 H_HARVEST = 1 + UNSEEN_COUNTER + MASK_H_HARVEST
 H_FIGHT = 1 + UNSEEN_COUNTER + MASK_H_FIGHT
+THREAT = 1 + H_FIGHT
+
+# LAYER DTYPES - (how the values of each layer of the map are stored)
+LAYER_DTYPES = (bool,     # WATER
+                uint8,    # OWN_HILLS
+                uint8,    # ENEMY_HILLS - owner
+                float32,  # FOOD - fading value
+                bool,     # OWN_ANTS
+                uint8,    # ENEMY_ANTS - owner
+                float32,  # OWN_DEAD - fading value
+                float32,  # ENEMY_DEAD - fading value
+                uint16,   # UNSEEN_COUNTER
+                float32,  # H_EXPLORE
+                float32,  # H_HARVEST
+                float32,  # H_FIGHT
+                uint8)    # THREAT - number of enemies
 
 # ENTITY SCENTS
 # Scents are power of four (or zero). Since scent intensity decreases in a
@@ -108,7 +149,6 @@ H_FIGHT = 1 + UNSEEN_COUNTER + MASK_H_FIGHT
 #    Scents are lists, each list element describe a different hormone. The
 # order in this list is EXPLORE, FOOD, FIGHT.
 OPAQUE = np_nan  # Not a Number!
-TRANSPARENT = -1  # Used in _get_scent_mask()
 SCENTS = {
     WATER : array((OPAQUE, OPAQUE, OPAQUE), dtype=float),
     UNSEEN_COUNTER : array((4**1, 0, 0), dtype=float),
@@ -120,6 +160,48 @@ SCENTS = {
     OWN_DEAD: array((4 ** 5, OPAQUE, 4 ** 5), dtype=float),
     ENEMY_DEAD: array((0, 0, 0), dtype=float),
 }
+# The same information as matrices (one row per layer in SCENT_LAYERS), split
+# between the scent emitted and the opacity of each entity.
+SCENT_LAYERS = (WATER, OWN_HILLS, ENEMY_HILLS, FOOD, OWN_ANTS, ENEMY_ANTS,
+                OWN_DEAD, ENEMY_DEAD, UNSEEN_COUNTER)
+OPACITIES = isnan(array([SCENTS[layer] for layer in SCENT_LAYERS]))
+EMISSIONS = nan_to_num(array([SCENTS[layer] for layer in SCENT_LAYERS]))
+
+# FLOW FIELDS - (max number of fields cached, see `get_flow_field()`)
+FLOW_FIELDS_CACHE = 16
+
+# SPATIAL INDEX - (layers whose entities are indexed in a bucket grid, and the
+# World dictionary listing them)
+INDEXED_LAYERS = {OWN_ANTS: 'own_ants',
+                  ENEMY_ANTS: 'enemy_ants',
+                  FOOD: 'food'}
+
+# ENGINE RECORDS
+# Each turn block is scanned once, by a single regular expression matching all
+# the record types. Its two alternatives (records with a position, records
+# with a position and an owner) capture the type of each record and its
+# numeric fields (row, col[, owner]) as a single string, so that all records
+# with the same number of fields are converted to integers by a single call to
+# numpy's `fromstring`, then split by type.
+RECORD = re.compile(r'^[ \t]*(?:([wf])[ \t]+(\d+[ \t]+\d+)|'
+                    r'([adh])[ \t]+(\d+[ \t]+\d+[ \t]+\d+))[ \t\r]*$', re.M)
+RECORDS = (('wf', 2), ('adh', 3))  # types and number of fields
+TURN_RECORD = re.compile(r'^[ \t]*turn[ \t]+(\d+)', re.M)
+
+# ORDERS
+# Orders are buffered as (row, col, direction code) triples and written all at
+# once at the end of the turn. The buffer doubles its size when full.
+ORDER_BUFFER_SIZE = 512
+# Orders are serialised as fixed width lines ('o RRR CCC d'), with numbers
+# right-aligned and padded with spaces (the engine splits lines on blanks),
+# so that the whole text of a turn can be assembled as a matrix of bytes.
+ORDER_TEMPLATE = frombuffer('o         x\n', dtype=uint8)
+ORDER_FIELDS = ((2, 0), (6, 1))  # (first char, buffer column) of row, col
+ORDER_DIGITS = 3  # maps are at most 200x200
+# The padded text of every number that fits in ORDER_DIGITS, one per row
+ORDER_NUMBERS = frombuffer(''.join(['%*d' % (ORDER_DIGITS, number) for number
+                                    in range(10 ** ORDER_DIGITS)]),
+                           dtype=uint8).reshape(-1, ORDER_DIGITS)
 
 # ANT ROLES
 EXPLORER = 0
@@ -138,6 +220,15 @@ DIRECTIONS = {'n': array((0, -1), int8),
               's': array((0, 1), int8),
               'w': array((-1, 0), int8)}
 
+# MOVES - (columns of the neighbour table: staying still, then the directions)
+MOVES = (0, 'n', 'e', 's', 'w')
+MOVE_OFFSETS = [(0, 0)] + [tuple(DIRECTIONS[move]) for move in MOVES[1:]]
+MOVE_INDEX = dict([(move, i) for i, move in enumerate(MOVES)])
+# Direction letter of each move (none for staying): the letters of an array of
+# moves are `MOVE_LETTERS[moves].tostring()`, as taken by `issue_orders()`
+MOVE_LETTERS = frombuffer('-' + ''.join(MOVES[1:]), dtype='S1')
+STAY_LAST = array(range(1, len(MOVES)) + [0])  # MOVES indices, staying last
+
 
 class World():
 
@@ -146,6 +237,15 @@ class World():
     of this class will be performed. See module documentation for details.
     '''
 
+    def __init__(self):
+        # Orders are kept here until `finish_turn()` sends them to the engine.
+        # The buffer is a numpy view on a Python array of C longs: single
+        # orders are written through the Python array (much cheaper than
+        # numpy's `itemset`), batches of orders through the view.
+        self.order_cells = py_array('l', [0]) * (3 * ORDER_BUFFER_SIZE)
+        self.orders = frombuffer(self.order_cells, dtype=int).reshape(-1, 3)
+        self.orders_count = 0
+
     def setup(self, data):
         '''
         Parse the initial input, containing data about the map size, the
@@ -159,28 +259,61 @@ class World():
           - attackradius2  # battle radius squared
           - spawnradius2   # food gathering radius squared (unfortunate name)
           - player_seed    # seed for random number generator
+        ``data`` is either a list of lines or the raw block as a string.
         '''
         # start timer
         self.turn_start_time = time()
         # Store received data
-        data = [line.split() for line in data]
+        if isinstance(data, str):
+            data = data.splitlines()
+        data = [line.split() for line in data if line.strip()]
         for k, v in data:
             setattr(self, k, int(v))
         # Initialise a few variables
         self.world_size = (self.cols, self.rows)
         self.turns_left = self.turns
         # Generate the empty map
-        # ATTENTION TO THE HARDCODED THIRD DIMENSION!!
-        self.map = zeros((self.cols, self.rows, 12), dtype=float)
+        self.map = LayeredMap(self.world_size, LAYER_DTYPES)
         # Compute radii
         self.attackradiusint = int(self.attackradius2**0.5)
         self.spawnradiusint = int(self.spawnradius2**0.5)
         self.viewradiusint = int(self.viewradius2**0.5)
         # Generate the field-of-view and attack-range masks
         self.view_mask = get_circular_mask(self.viewradius2)
+        self.view_runs = get_mask_runs(self.view_mask)
+        self.view_crescents = [(move,) + get_crescents(self.view_mask, *move)
+                               for move in ((0, -1), (1, 0), (0, 1), (-1, 0))]
+        # Number of own ants seeing each tile, updated incrementally from
+        # the ants that moved, appeared or died (see `_update_view_counter()`)
+        self.view_count = None
+        self.last_own_ants = None
         self.attack_mask = get_circular_mask(self.attackradius2)
         self.engage_mask = get_attack_plus_two(self.attackradius2)
         self.movement_mask = get_circular_mask(1)
+        # Whether two ants end up within attack radius, by relative offset
+        # (within the engage window) and moves of the two ants
+        self.combat_radius = self.attackradiusint + 2
+        self.combat_table = get_combat_table(self.attackradius2,
+                                             self.combat_radius, MOVE_OFFSETS)
+        # Runs of the masks of the tiles an enemy can attack next turn, by
+        # subset of legal moves (see `_update_threat()`)
+        self.threat_runs = {}
+        # Flat index of each tile and of its neighbours (one column per move
+        # in MOVES): the flat index of (col, row) is col * ROWS + row
+        self.neighbours = get_neighbour_table(self.world_size, MOVE_OFFSETS)
+        # Flow fields by target set, dropped when new water is found
+        self.flow_fields = {}
+        # Paths searched so far, dropped when new water is found across them
+        self.pathfinder = Pathfinder(self, self.map.planes[WATER])
+        # Bucket grids indexing the sparse entities, rebuilt every turn (see
+        # `_update_spatial_index()`)
+        self.spatial_index = dict([(layer, GridIndex(self.world_size,
+                                                     self.viewradiusint))
+                                   for layer in INDEXED_LAYERS])
+        # Diffusion engines are created (and allocate their buffers) on
+        # first use, see `_get_diffuser()`
+        self.diffusers = {}
+        self.scent_layers = zeros((len(SCENT_LAYERS), self.cols * self.rows))
         # Initialise dictionaries for those temporary but non-moveable entities
         # whose visibility may change.
         self.food = {}
@@ -195,7 +328,8 @@ class World():
 
     def _update(self, data):
         '''
-        Parse engine input, updating the map.
+        Parse engine input, updating the map. ``data`` is either a list of
+        lines or the raw block as a string (see blockreader.py).
         '''
         # START TIMER
         self.turn_start_time = time()
@@ -204,7 +338,8 @@ class World():
             log.info('## TURN %03d ##' % self.turn)
 
         # RESET the MAP - only water is an immutable characteristic of the map
-        self.map[..., WATER + 1:] = 0
+        for plane in self.map.planes[WATER + 1:]:
+            plane.fill(0)
 
         # RESET TURN VARIABLES - turn variables are really just redoundant,
         # given that one could poll the map instead, but they are convenient
@@ -215,11 +350,17 @@ class World():
         # The rest of the update procedure has been devided in other methods
         # to facilitate code managment and profiling.
         self._parse_input_lines(data)
+        self.pathfinder.invalidate(self.new_water.tolist())
+        if len(self.new_water):
+            self.flow_fields.clear()
         self._update_view_counter()
         self._update_hills()
         self._update_faders()
+        self._update_threat()  # needs food, written by `_update_faders()`
+        self._update_spatial_index()
 
-    def diffuse(self, abs_left=None, perc_left=None):
+    def diffuse(self, abs_left=None, perc_left=None, warm=WARM_DIFFUSION,
+                backend=DIFFUSION_BACKEND):
         '''
         Diffuse scents over the map. Diffusion progresses until the time left
         to the end of the turn equals ``abs_left``. Specify the time that must
@@ -227,44 +368,27 @@ class World():
         value in ms or as percentage of the turn length.
         - abs_limit  : milliseconds to leave after diffusion
         - perc_limit : percentage of turn time to leave after diffusion
+        - warm       : start from the previous turn's field
+        - backend    : diffusion engine to use (see diffusion.py)
         '''
-        # reset the scents
-        self.map[:, :, H_EXPLORE:] *= 0
         # fix the limit of diffusion
         hard_time_limit, max_diffusion_steps = \
             self._get_diffusion_limits(abs_left, perc_left)
         # creating the starting mask (emitters' own smell)
-        scent_mask = self._get_scent_mask()
-        idx = scent_mask >= 0
-
-        # CREATE THE BLITTING LAYERS
-        single_layer = zeros((self.cols, self.rows, 3), dtype=float)
-        single_layer[idx] = scent_mask[idx]  # seed layer with emitters
-        layers = [single_layer, single_layer.copy()]
-        toggler = False
-
+        diffuser = self.diffuser = self._get_diffuser(backend)
+        diffuser.prepare(*self._get_scent_mask())
         # DIFFUSE!
-        counter = 0
-        while time() < hard_time_limit and counter < max_diffusion_steps:
-            counter += 1
-            toggler = not toggler
-            source = layers[toggler]
-            dest = layers[not toggler]
-            dest *= 0
-            # calculate the scent for each tile
-            for amount, axis in ((1, 0), (1, 1), (-1, 0), (-1, 1)):
-                dest += roll(source, amount, axis=axis)
-            dest *= 0.25
-            # blit the emitters map
-            dest[idx] += scent_mask[idx]
-            # remove scent where blocked
-            condition = where(scent_mask == 0)
-            dest[condition] = 0
+        counter = diffuser.run(hard_time_limit, max_diffusion_steps, warm,
+                               DIFFUSION_TOLERANCE)
         # transfer back to world map
-        self.map[:, :, H_EXPLORE:] = dest
+        for hormone, plane in enumerate(diffuser.field):
+            self.map[..., H_EXPLORE + hormone] = plane
         if RUNS_LOCALLY:
-            log.info('DIFFUSE : %d passes, %d needed' %
-                (counter, max_diffusion_steps))
+            saved = max_diffusion_steps - counter if diffuser.converged else 0
+            log.info('DIFFUSE : %d passes, %d needed, %d saved, '
+                     '%.2e residual, %.2f passes/ms' %
+                (counter, max_diffusion_steps, saved,
+                 max(diffuser.residuals), diffuser.rate))
 
     def is_tile_visible(self, loc):
         '''
@@ -276,21 +400,17 @@ class World():
         '''
         Return True if location is not occupied by an obstacle.
         '''
-        return 0 == self.map[loc][WATER] == self.map[loc][OWN_ANTS] \
-                 == self.map[loc][FOOD] == self.map[loc][ENEMY_ANTS]
+        m = self.map
+        x, y = loc
+        return 0 == m[x, y, WATER] == m[x, y, OWN_ANTS] \
+                 == m[x, y, FOOD] == m[x, y, ENEMY_ANTS]
 
     def get_stuff_in_sight(self, loc, layer):
         '''
         Return the location of all the entities of layer `layer` that are
         visible from location `loc`
         '''
-        m = self.map
-        wsize = self.world_size
-        mask = self.view_mask
-        idx = [(axis + loc[i]) % wsize[i] for i, axis in enumerate(mask)]
-        # For the following lines see: http://goo.gl/zY6VD
-        transposed = array(idx).T
-        return transposed[where(m[idx][..., layer])[0]]
+        return self._spatial_join((loc, ), self.view_mask, layer)[1]
 
     def get_engageable(self, loc):
         '''
@@ -298,43 +418,122 @@ class World():
         following turn (battle mask = attack radius + 2) with an enemy ant
         located at `loc`.
         '''
-        m = self.map
-        wsize = self.world_size
-        mask = self.engage_mask
-        idx = [(axis + loc[i]) % wsize[i] for i, axis in enumerate(mask)]
-        # For the following lines see: http://goo.gl/zY6VD
-        transposed = array(idx).T
-        return transposed[where(m[idx][..., OWN_ANTS])[0]]
+        return self._spatial_join((loc, ), self.engage_mask, OWN_ANTS)[1]
 
     def get_in_attackradius(self, loc):
         '''
         Returns a list of enemy ants that are within attack radius from
         location `loc`.
         '''
-        m = self.map
-        wsize = self.world_size
-        mask = self.attack_mask
-        idx = [(axis + loc[i]) % wsize[i] for i, axis in enumerate(mask)]
-        # For the following lines see: http://goo.gl/zY6VD
-        transposed = array(idx).T
-        return transposed[where(m[idx][..., ENEMY_ANTS])[0]]
+        return self._spatial_join((loc, ), self.attack_mask, ENEMY_ANTS)[1]
+
+    def get_stuff_in_sight_batch(self, locs, layer):
+        '''
+        Batch version of `get_stuff_in_sight` for a N x 2 array of locations.
+        Return two arrays: the index in `locs` of each query and the location
+        of the entity it sees (one row per (query, entity) pair, grouped by
+        query).
+        '''
+        return self._spatial_join(locs, self.view_mask, layer)
+
+    def get_engageable_batch(self, locs):
+        '''
+        Batch version of `get_engageable`, see `get_stuff_in_sight_batch`.
+        '''
+        return self._spatial_join(locs, self.engage_mask, OWN_ANTS)
+
+    def get_in_attackradius_batch(self, locs):
+        '''
+        Batch version of `get_in_attackradius`, see
+        `get_stuff_in_sight_batch`.
+        '''
+        return self._spatial_join(locs, self.attack_mask, ENEMY_ANTS)
+
+    def get_nearby(self, loc, layer, radius2):
+        '''
+        Return the locations of the entities of layer `layer` (one of
+        INDEXED_LAYERS) within `radius2` from `loc`, using the spatial index.
+        '''
+        return self.spatial_index[layer].within(loc, radius2)[1]
+
+    def get_nearest(self, loc, layer, k=1):
+        '''
+        Return the locations of the `k` entities of layer `layer` (one of
+        INDEXED_LAYERS) closest to `loc` and their squared distances, closest
+        first, using the spatial index.
+        '''
+        return self.spatial_index[layer].nearest(loc, k)[1:]
 
     def issue_order(self, order):
         '''
-        Issue an order by writing the proper ant location and direction.
+        Issue an order by buffering the proper ant location and direction. The
+        order is sent to the engine by `finish_turn()`.
         '''
         (col, row), direction = order
-        # note that game API wants row before col!
-        sys.stdout.write('o %s %s %s\n' % (row, col, direction))
+        count = self.orders_count
+        index = 3 * count
+        # note that game API wants row before col! (the last cell is written
+        # first, so that a full buffer fails before any write)
+        cells = self.order_cells
+        try:
+            cells[index + 2] = ord(direction)
+        except IndexError:
+            self._grow_orders(count + 1)
+            cells = self.order_cells
+            cells[index + 2] = ord(direction)
+        cells[index] = row
+        cells[index + 1] = col
+        self.orders_count = count + 1
+
+    def issue_orders(self, locs, directions):
+        '''
+        Issue the orders for many ants at once. `locs` is a N x 2 array of ant
+        locations (col, row), `directions` a sequence of N direction letters.
+        '''
+        locs = asarray(locs).reshape(-1, 2)
+        start = self.orders_count
+        end = start + len(locs)
+        if end > len(self.orders):
+            self._grow_orders(end)
+        orders = self.orders[start:end]
+        orders[:, 0] = locs[:, 1]
+        orders[:, 1] = locs[:, 0]
+        orders[:, 2] = frombuffer(''.join(directions), dtype=uint8)
+        self.orders_count = end
+
+    def get_pending_orders(self):
+        '''
+        Return the orders issued so far this turn, as a N x 3 array of (row,
+        col, direction code) triples. The array is a view on the buffer, so it
+        can be modified in place.
+        '''
+        return self.orders[:self.orders_count]
+
+    def dedupe_orders(self):
+        '''
+        Remove pending orders given to an ant that already received one,
+        keeping only the first order issued to each ant.
+        '''
+        pending = self.get_pending_orders()
+        keys = (pending[:, 0] << 16) | pending[:, 1]
+        first = unique(keys, return_index=True)[1]
+        if len(first) < len(pending):
+            first.sort()
+            self.orders[:len(first)] = pending[first]
+            self.orders_count = len(first)
 
     def finish_turn(self):
         '''
-        Finish the turn by writing the go line.
+        Finish the turn by writing all the pending orders and the go line with
+        a single write.
         '''
+        self.dedupe_orders()
+        orders = self._serialise_orders(self.get_pending_orders())
+        self.orders_count = 0
         if RUNS_LOCALLY:
             duration = int((time() - self.turn_start_time) * 1000)
             log.info('TURN DURATION : %d ms' % duration)
-        sys.stdout.write('go\n')
+        sys.stdout.write(orders + 'go\n')
         sys.stdout.flush()
 
     def time_remaining(self):
@@ -348,18 +547,25 @@ class World():
     def manhattan(self, loc1, loc2):
         '''
         Return the distance between two location in taxicab geometry.
-        Uses the numpy arrays and wrap/warp correctly.
+        Uses the numpy arrays and wrap/warp correctly. Either location can
+        also be a N x 2 array, in which case an array of N distances is
+        returned.
         '''
         absolute = np_abs(loc1 - loc2)  # slightly faster than abs()
         modular = self.world_size - absolute
-        return sum(minimum(absolute, modular))  # slightly faster than a.sum()
+        distances = minimum(absolute, modular)
+        if distances.ndim > 1:  # N x 2 arrays of locations
+            return distances.sum(axis=-1)
+        return sum(distances)  # slightly faster than a.sum()
 
     def destination(self, loc, direction):
         '''
         Return target location given the direction.
-        Uses the numpy arrays and wrap/warp correctly.
+        Uses the neighbour table, so it wraps/warps correctly.
         '''
-        return (loc + DIRECTIONS[direction]) % self.world_size
+        rows = self.rows
+        dest = self.neighbours[loc[0] * rows + loc[1], MOVE_INDEX[direction]]
+        return array(divmod(dest, rows))
 
     def get_scent_strengths(self, loc, hormone):
         '''
@@ -367,12 +573,12 @@ class World():
         according to scent intensity. The returned value of `scent` refers to
         the intensity of `hormone`.
         '''
-        result = []
-        for direction, offset in DIRECTIONS.items():
-            destination = tuple((loc + offset) % self.world_size)
-            scent = self.map[..., hormone][destination]
-            result.append([scent, destination, direction])
-        return sorted(result, reverse=True)
+        rows = self.rows
+        dests = self.neighbours[loc[0] * rows + loc[1], 1:].tolist()
+        scents = self.map.planes[hormone].ravel()[dests].tolist()
+        return sorted([[scent, divmod(dest, rows), direction] for
+                       scent, dest, direction in zip(scents, dests, MOVES[1:])],
+                      reverse=True)
 
     def get_legal_moves(self, loc):
         '''
@@ -381,62 +587,317 @@ class World():
         with an unmoveable obstacle (water or food). In other terms: a legal
         move include moves generating collisions with other ants.
         '''
-        result = [[loc, 0]]
-        map_ = self.map
-        for direction, offset in DIRECTIONS.items():
-            x, y = (loc + offset) % self.world_size
-            if not (map_[x, y, WATER] or map_[x, y, FOOD]):
-                result.append([(x, y), direction])
-        return result
+        rows = self.rows
+        dests = self.neighbours[loc[0] * rows + loc[1], 1:]
+        legal = self._get_free_of_obstacles(dests).tolist()
+        return [[loc, 0]] + [[divmod(dest, rows), direction] for
+                             dest, direction, ok in
+                             zip(dests.tolist(), MOVES[1:], legal) if ok]
+
+    def get_relative_offset(self, loc1, loc2):
+        '''
+        Return the shortest (d_col, d_row) offset leading from `loc1` to
+        `loc2` on the torus.
+        '''
+        cols, rows = self.world_size
+        return ((loc2[0] - loc1[0] + cols // 2) % cols - cols // 2,
+                (loc2[1] - loc1[1] + rows // 2) % rows - rows // 2)
+
+    def get_combat_outcomes(self, own, enemy):
+        '''
+        Return a 5 x 5 boolean array telling, for each move of the own ant in
+        `own` (rows, in MOVES order) and each move of the enemy ant in `enemy`
+        (columns), whether the two ants end up within attack radius. Return
+        None if the ants are too far apart to get in range next turn. Moves
+        are not checked for legality (see `get_legal_moves`).
+        '''
+        d_col, d_row = self.get_relative_offset(own, enemy)
+        radius = self.combat_radius
+        if abs(d_col) > radius or abs(d_row) > radius:
+            return None
+        return self.combat_table[d_col + radius, d_row + radius]
+
+    def get_flat_indices(self, locs):
+        '''
+        Return the flat indices (col * ROWS + row) of a N x 2 array of
+        locations.
+        '''
+        locs = asarray(locs, dtype=int).reshape(-1, 2)
+        return locs[:, 0] * self.rows + locs[:, 1]
+
+    def get_scent_strengths_all(self, locs, hormone):
+        '''
+        Vectorised `get_scent_strengths` for a N x 2 array of locations.
+        Return two N x 4 arrays (one column per direction in MOVES[1:]): the
+        intensity of `hormone` at each destination, and the flat index of the
+        destinations themselves. Sorting is left to the caller.
+        '''
+        dests = self.neighbours[self.get_flat_indices(locs), 1:]
+        return self.map.planes[hormone].ravel()[dests], dests
+
+    def get_scent_rankings(self, locs, hormone):
+        '''
+        Return two N x 5 arrays for a N x 2 array of locations: the moves
+        (indices in MOVES, staying included) of each ant ranked by the
+        intensity of `hormone` at their destination, strongest first, and
+        the flat index of the destinations in the same order. Ties keep the
+        MOVES order, except for staying, which is ranked last among equals.
+        '''
+        dests = self.neighbours[self.get_flat_indices(locs)]
+        scents = self.map.planes[hormone].ravel()[dests[:, STAY_LAST]]
+        ranking = STAY_LAST[(-scents).argsort(axis=1, kind='mergesort')]
+        return ranking, dests[arange(len(dests)).reshape(-1, 1), ranking]
+
+    def get_legal_moves_all(self, locs):
+        '''
+        Vectorised `get_legal_moves` for a N x 2 array of locations. Return
+        two N x 5 arrays (one column per move in MOVES): the flat index of the
+        destinations, and whether each move is legal (staying always is).
+        '''
+        dests = self.neighbours[self.get_flat_indices(locs)]
+        legal = self._get_free_of_obstacles(dests)
+        legal[:, 0] = True
+        return dests, legal
+
+    def get_distances(self, sources, max_distance=None):
+        '''
+        Return two flat arrays: the length of the shortest path over land
+        (water is the only obstacle) from each tile to the closest of the
+        tiles with flat indices `sources` (inf if unreachable or farther than
+        `max_distance`), and the index in `sources` of that closest source
+        (-1).
+        '''
+        return multi_source_bfs(sources, ~self.map.planes[WATER].ravel(),
+                                self.neighbours[:, 1:],
+                                max_distance=max_distance)
+
+    def get_flow_field(self, targets):
+        '''
+        Return a COLS x ROWS uint8 plane leading to the closest of the
+        `targets` locations: each tile holds the move (index in MOVES) to a
+        neighbour one tile closer along the shortest path over land, 0 on
+        the targets and on the tiles that can't reach them. Any number of
+        ants can then follow the field with a lookup. Fields are computed
+        with a single BFS from the targets, and cached until the targets or
+        the water change (the plane is shared: it must not be modified).
+        '''
+        key = tuple(sorted(set(self.get_flat_indices(targets).tolist())))
+        try:
+            return self.flow_fields[key]
+        except KeyError:
+            pass
+        if len(self.flow_fields) >= FLOW_FIELDS_CACHE:
+            self.flow_fields.clear()
+        distance = self.get_distances(key)[0]
+        closer = (distance[self.neighbours[:, 1:]] ==
+                  (distance - 1).reshape(-1, 1)) & \
+                 (distance < inf).reshape(-1, 1)
+        field = where(closer.any(axis=1), closer.argmax(axis=1) + 1, 0)
+        field = field.astype(uint8).reshape(self.world_size)
+        self.flow_fields[key] = field
+        return field
+
+    def get_path(self, loc1, loc2, max_nodes=None):
+        '''
+        Return the list of the locations leading from `loc1` (excluded) to
+        `loc2` along a shortest path avoiding known water, or None if there
+        is none. Paths are cached across turns (see pathfinding.py).
+        '''
+        rows = self.rows
+        path = self.pathfinder.get_path(loc1[0] * rows + loc1[1],
+                                        loc2[0] * rows + loc2[1], max_nodes)
+        if path is None:
+            return None
+        return [divmod(tile, rows) for tile in path]
+
+    def get_passable(self):
+        '''
+        Return a flat boolean array, True for the tiles that are not
+        occupied by an obstacle (see `is_tile_passable`).
+        '''
+        planes = self.map.planes
+        return ~(planes[WATER] | planes[OWN_ANTS] | (planes[FOOD] != 0) |
+                 (planes[ENEMY_ANTS] != 0)).ravel()
 
     def _parse_input_lines(self, data):
         '''
-        Parse the data received by the game engine.
-        '''
-        for line in data:
-            tokens = line.split()
-            if len(tokens) >= 3:
-                row = int(tokens[1])
-                col = int(tokens[2])
-                if tokens[0] == 'w':
-                    self.map[col][row][WATER] = True
-                elif tokens[0] == 'f':
-                    self.food[(col, row)] = 1
-                else:
-                    owner = int(tokens[3])
-                    if tokens[0] == 'a':
-                        if not owner:  # owner == 0 → player's ant
-                            self.map[col][row][OWN_ANTS] = 1
-                            self.own_ants[(col, row)] = EXPLORER
-                        else:
-                            self.map[col][row][ENEMY_ANTS] = owner
-                            self.enemy_ants[(col, row)] = owner
-                    elif tokens[0] == 'd':
-                        if not owner:  # owner == 0 → player's dead
-                            self.own_dead[(col, row)] = 1
-                        else:
-                            self.enemy_dead[(col, row)] = [1, owner]
-                    elif tokens[0] == 'h':
-                        if not owner:  # owner == 0 → player's hill
-                            self.own_hills[(col, row)] = JUST_SEEN
-                        else:
-                            self.enemy_hills[(col, row)] = [JUST_SEEN, owner]
-            elif tokens[0] == 'turn':
-                self.turn = int(tokens[1])
-                self.turns_left = self.turns - self.turn
+        Parse the data received by the game engine. The whole turn block is
+        tokenised at once: records are grouped by type in integer arrays and
+        each group is written to the map with a single fancy-index assignment.
+        '''
+        block = data if isinstance(data, str) else '\n'.join(data)
+        turn = TURN_RECORD.search(block)
+        if turn:
+            self.turn = int(turn.group(1))
+            self.turns_left = self.turns - self.turn
+        records = self._get_records(block)
+        planes = self.map.planes
+        # WATER
+        rows, cols = records['w']
+        new = ~planes[WATER][cols, rows]
+        self.new_water = cols[new] * self.rows + rows[new]
+        planes[WATER][cols, rows] = True
+        # FOOD
+        rows, cols = records['f']
+        self.food.update(dict.fromkeys(zip(cols.tolist(), rows.tolist()), 1))
+        # ANTS
+        rows, cols, owners = records['a']
+        own = owners == 0
+        planes[OWN_ANTS][cols[own], rows[own]] = True
+        self.own_ants.update(dict.fromkeys(
+            zip(cols[own].tolist(), rows[own].tolist()), EXPLORER))
+        enemy = ~own
+        planes[ENEMY_ANTS][cols[enemy], rows[enemy]] = owners[enemy]
+        self.enemy_ants.update(zip(zip(cols[enemy].tolist(),
+                                       rows[enemy].tolist()),
+                                   owners[enemy].tolist()))
+        # DEAD ANTS
+        rows, cols, owners = records['d']
+        own = owners == 0
+        self.own_dead.update(dict.fromkeys(
+            zip(cols[own].tolist(), rows[own].tolist()), 1))
+        enemy = ~own
+        for loc, owner in zip(zip(cols[enemy].tolist(), rows[enemy].tolist()),
+                              owners[enemy].tolist()):
+            self.enemy_dead[loc] = [1, owner]
+        # HILLS
+        rows, cols, owners = records['h']
+        own = owners == 0
+        self.own_hills.update(dict.fromkeys(
+            zip(cols[own].tolist(), rows[own].tolist()), JUST_SEEN))
+        enemy = ~own
+        for loc, owner in zip(zip(cols[enemy].tolist(), rows[enemy].tolist()),
+                              owners[enemy].tolist()):
+            self.enemy_hills[loc] = [JUST_SEEN, owner]
+
+    def _get_records(self, block):
+        '''
+        Return a dictionary with the fields of the records of each type in
+        `block` (row, col and -if the record has one- owner), as one integer
+        array per field. The block is scanned once, and the numbers of all the
+        records with the same number of fields are converted at once.
+        '''
+        matches = RECORD.findall(block)
+        # one (types, fields) pair of columns per alternative of RECORD, with
+        # empty strings for the records matched by the other alternative
+        columns = zip(*matches) if matches else [()] * 4
+        records = {}
+        for (types, width), kinds, fields in zip(RECORDS, columns[::2],
+                                                  columns[1::2]):
+            kinds = frombuffer(''.join(kinds), dtype='S1')
+            values = fromstring(' '.join(filter(None, fields)), dtype=int,
+                                sep=' ').reshape(-1, width)
+            for kind in types:
+                records[kind] = values[kinds == kind].T
+        return records
 
     def _update_view_counter(self):
         '''
-        Increment the `last view counter` for all the map, then use view_mask
-        to reset it where land is visible.
+        Increment the `last view counter` for all the map, then reset it where
+        land is visible. Visibility comes from `view_count`, the number of own
+        ants seeing each tile: computed for the whole map on the first turn
+        (as the dilation of the own ants plane by the view mask), and then
+        only corrected for the ants that changed position.
+        '''
+        ants = self.map.planes[OWN_ANTS]
+        if self.view_count is None:
+            self.view_count = dilate_count(ants, self.view_runs)
+        else:
+            self._update_view_count(self.last_own_ants, ants)
+        self.last_own_ants = ants.copy()
+        self.visible = self.view_count > 0
+        counter = self.map.planes[UNSEEN_COUNTER]
+        counter[...] = where(self.visible, 0, counter + UNSEEN_LAND_STEP)
+
+    def _update_view_count(self, before, after):
+        '''
+        Apply to `view_count` the difference between the `before` and `after`
+        own ants planes. A tile left by an ant and the adjacent tile entered
+        by an ant are paired as a move (which ant it actually was does not
+        change the counts) and only the crescents of the view mask gained and
+        lost are applied; any other appeared or vanished ant adds or removes
+        its whole view mask.
+        '''
+        rows = self.rows
+        appeared = (after & ~before).ravel()
+        vanished = flatnonzero(before & ~after)
+        left = ones(len(vanished), dtype=bool)  # vanished not paired yet
+        gained, lost = [], []
+        for (d_col, d_row), plus, minus in self.view_crescents:
+            # ants that left `loc` for `loc + (d_col, d_row)`
+            candidates = vanished[left]
+            cols, rows_ = divmod(candidates, rows)
+            targets = ((cols + d_col) % self.cols) * rows + \
+                      (rows_ + d_row) % rows
+            moved = appeared[targets]
+            if not moved.any():
+                continue
+            appeared[targets[moved]] = False
+            left[flatnonzero(left)[moved]] = False
+            locs = cols[moved], rows_[moved]
+            gained.append(self._get_tiles(locs, plus))
+            lost.append(self._get_tiles(locs, minus))
+        gained.append(self._get_tiles(divmod(flatnonzero(appeared), rows),
+                                      self.view_mask))
+        lost.append(self._get_tiles(divmod(vanished[left], rows),
+                                    self.view_mask))
+        size = self.cols * self.rows
+        view_count = self.view_count.reshape(-1)  # a view, not a copy
+        view_count += bincount(concatenate(gained), minlength=size)
+        view_count -= bincount(concatenate(lost), minlength=size)
+
+    def _get_tiles(self, locs, mask):
+        '''
+        Return the flat indices of the tiles at the offsets in `mask` from
+        each of the `locs` (a tuple of arrays of cols and rows).
         '''
-        map_ = self.map
-        mask = self.view_mask
-        map_[..., UNSEEN_COUNTER] += UNSEEN_LAND_STEP
-        for loc in self.own_ants:
-            map_[:, :, UNSEEN_COUNTER][[(axis + loc[i]) % \
-                    self.world_size[i] for i, axis in \
-                    enumerate(mask)]] = 0
+        cols, rows = [axis.reshape(-1, 1) for axis in locs]
+        return (((cols + mask[0]) % self.cols) * self.rows +
+                (rows + mask[1]) % self.rows).ravel()
+
+    def _update_spatial_index(self):
+        '''
+        Rebuild the bucket grids of the entities in INDEXED_LAYERS.
+        '''
+        for layer, name in INDEXED_LAYERS.items():
+            self.spatial_index[layer].build(getattr(self, name).keys())
+
+    def _update_threat(self):
+        '''
+        Fill the THREAT layer with the number of enemy ants that could attack
+        each tile next turn: the dilation of the enemy ants plane by the
+        attack mask, grown by the legal moves of each ant. Ants are grouped
+        by their set of legal moves, so that each group is a single dilation.
+        '''
+        threat = self.map.planes[THREAT]
+        if not self.enemy_ants:
+            threat.fill(0)
+            return
+        locs = array(self.enemy_ants.keys())
+        legal = self.get_legal_moves_all(locs)[1]
+        subsets = legal[:, 1:].dot(array((1, 2, 4, 8)))
+        counts = zeros(self.world_size, dtype=int)
+        for subset in unique(subsets).tolist():
+            group = locs[subsets == subset]
+            plane = zeros(self.world_size, dtype=bool)
+            plane[group[:, 0], group[:, 1]] = True
+            counts += dilate_count(plane, self._get_threat_runs(subset))
+        threat[...] = minimum(counts, 255)
+
+    def _get_threat_runs(self, subset):
+        '''
+        Return the runs (see `get_mask_runs`) of the tiles that an ant can
+        attack after one move among those in `subset` (a bit field over the
+        directions in MOVES[1:]) or after standing still.
+        '''
+        if subset not in self.threat_runs:
+            moves = [offset for i, offset in enumerate(MOVE_OFFSETS)
+                     if not i or subset >> (i - 1) & 1]
+            offsets = set([(d_col + m_col, d_row + m_row) for d_col, d_row in
+                           zip(*self.attack_mask) for m_col, m_row in moves])
+            mask = tuple(array(sorted(offsets)).T)
+            self.threat_runs[subset] = get_mask_runs(mask)
+        return self.threat_runs[subset]
 
     def _update_hills(self):
         '''
@@ -453,7 +914,7 @@ class World():
             elif status == JUST_SEEN:
                 hills[hill] = PREVIOUSLY_SEEN
             if hills[hill] != RAZED:
-                self.map[hill][OWN_HILLS] = 1
+                self.map[hill[0], hill[1], OWN_HILLS] = 1
         # ENEMY HILLS - they have the owner too!
         hills = self.enemy_hills
         for hill, (status, owner) in hills.items():
@@ -462,7 +923,7 @@ class World():
             elif status == JUST_SEEN:
                 hills[hill] = [PREVIOUSLY_SEEN, owner]
             if hills[hill][0] != RAZED:
-                self.map[hill][ENEMY_HILLS] = owner
+                self.map[hill[0], hill[1], ENEMY_HILLS] = owner
 
     def _update_faders(self):
         '''
@@ -478,7 +939,7 @@ class World():
             if value <= 0 or (value < 1 and self.is_tile_visible(loc)):
                 to_remove.append(loc)
             else:
-                self.map[loc][FOOD] = value
+                self.map[loc[0], loc[1], FOOD] = value
                 self.food[loc] -= FADING_UNSEEN_FOOD
         for loc in to_remove:
             del self.food[loc]
@@ -492,7 +953,7 @@ class World():
             if value <= 0:
                 to_remove.append(loc)
             else:
-                self.map[loc][OWN_DEAD] = value
+                self.map[loc[0], loc[1], OWN_DEAD] = value
                 self.own_dead[loc] -= FADING_OWN_DEAD
         for loc in to_remove:
             del self.own_dead[loc]
@@ -501,11 +962,77 @@ class World():
             if value <= 0:
                 to_remove.append(loc)
             else:
-                self.map[loc][ENEMY_DEAD] = value
+                self.map[loc[0], loc[1], ENEMY_DEAD] = value
                 self.enemy_dead[loc][0] -= FADING_ENEMY_DEAD
         for loc in to_remove:
             del self.enemy_dead[loc]
 
+    def _get_free_of_obstacles(self, dests):
+        '''
+        Return True for the flat indices in `dests` that are free from
+        unmoveable obstacles (water or food).
+        '''
+        planes = self.map.planes
+        return ~(planes[WATER].ravel()[dests] |
+                 (planes[FOOD].ravel()[dests] != 0))
+
+    def _spatial_join(self, locs, mask, layer):
+        '''
+        Return all the pairs (query, entity) such that the entity is on layer
+        `layer` at one of the offsets in `mask` from the location of the query.
+        The result is the array of query indices in `locs` and the N x 2 array
+        of the entities' locations, in mask order within each query.
+        '''
+        locs = asarray(locs, dtype=int).reshape(-1, 2)
+        # N x len(mask) arrays of the wrapped cols and rows around each query
+        cols = (locs[:, :1] + mask[0]) % self.cols
+        rows = (locs[:, 1:] + mask[1]) % self.rows
+        query, offset = nonzero(self.map.planes[layer][cols, rows])
+        return query, column_stack((cols[query, offset],
+                                    rows[query, offset]))
+
+    def _grow_orders(self, size):
+        '''
+        Enlarge the order buffer so that it can hold at least `size` orders.
+        '''
+        capacity = len(self.orders)
+        while capacity < size:
+            capacity *= 2
+        cells = py_array('l', [0]) * (3 * capacity)
+        used = 3 * self.orders_count
+        cells[:used] = self.order_cells[:used]
+        self.order_cells = cells
+        self.orders = frombuffer(cells, dtype=int).reshape(-1, 3)
+
+    def _serialise_orders(self, orders):
+        '''
+        Return the text sent to the engine for the N x 3 `orders` array. All
+        lines have the same length, so the text is built as a N x LINE matrix
+        of characters, one field at a time (numbers are looked up in
+        ORDER_NUMBERS).
+        '''
+        text = empty((len(orders), len(ORDER_TEMPLATE)), dtype=uint8)
+        text[:] = ORDER_TEMPLATE
+        for first, column in ORDER_FIELDS:
+            text[:, first:first + ORDER_DIGITS] = \
+                ORDER_NUMBERS[orders[:, column]]
+        text[:, -2] = orders[:, 2]
+        return text.tostring()
+
+    def _get_diffuser(self, backend):
+        '''
+        Return the diffusion engine for ``backend``, creating it if needed.
+        Unavailable backends fall back to JACOBI.
+        '''
+        if backend not in BACKENDS:
+            backend = JACOBI
+        try:
+            return self.diffusers[backend]
+        except KeyError:
+            diffuser = BACKENDS[backend](self.cols, self.rows)
+            self.diffusers[backend] = diffuser
+            return diffuser
+
     def _get_diffusion_limits(self, abs_left, perc_left):
         '''
         Return the limits for the diffusion process:
@@ -528,27 +1055,18 @@ class World():
 
     def _get_scent_mask(self):
         '''
-        Return a COLS x ROWS x HORMONES mask of scent emitters. This is used
-        to initiate the diffusion process.
-        '''
-        map_ = self.map
-        # initialise the mask
-        scent_mask = zeros((self.cols, self.rows, 3), dtype=float)
-        # cycle through all the layers that can contain emitters...
-        for layer in (WATER, OWN_HILLS, ENEMY_HILLS, FOOD, OWN_ANTS,
-                      ENEMY_ANTS, OWN_DEAD, ENEMY_DEAD, UNSEEN_COUNTER):
-            # ...isolate those who have them...
-            positions = nonzero(map_[..., layer])
-            # ...and blit on the mask, in that position, their value multiplied
-            # the standard scent for that entity!
-            scent_mask[positions] += \
-                map_[positions][..., layer].reshape(len(positions[0]), 1) \
-                * SCENTS[layer]
-        # here there is some magic: we used numpy's NaN as "OPAQUE" because
-        # we wanted to be impossible to sum scents in that location. Now that
-        # the mask is ready - though - we want the mask to explicitely say
-        # "here goes no scent" where NaN was. Conversely, we want a way to
-        # indicate where scent should be flowing indisturbed...
-        scent_mask[scent_mask == 0] = -1
-        scent_mask[isnan(scent_mask)] = 0
-        return scent_mask
+        Return the two HORMONES x COLS x ROWS arrays used to initiate the
+        diffusion process: the scent emitted on each tile, and the opacity
+        (True where no scent can be).
+        '''
+        # Copy the layers that can contain emitters in a LAYERS x TILES
+        # stack: the mask is then a product with the SCENTS matrices.
+        layers = self.scent_layers
+        for i, layer in enumerate(SCENT_LAYERS):
+            layers[i] = self.map.planes[layer].ravel()
+        shape = (3, self.cols, self.rows)
+        emitters = EMISSIONS.T.dot(layers).reshape(shape)
+        # A boolean dot product is an OR of ANDs: a tile is opaque to a
+        # hormone if any of the entities on it is opaque to it.
+        opaque = OPACITIES.T.dot(layers != 0).reshape(shape)
+        return emitters, opaque